@@ -0,0 +1,215 @@
+"""
+Armazenamento dos ícones por conteúdo (content-addressed)
+
+Cada ícone é gravado em uploads/ com o nome <sha256><extensão>, então o mesmo
+arquivo usado em vários botões existe uma única vez no disco. A tabela
+icon_blobs guarda quantos botões referenciam cada arquivo; quando a contagem
+chega a zero, o arquivo é removido pela coleta de lixo em segundo plano após
+um período de carência (BLOB_GC_GRACE_SECONDS).
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from pathlib import Path
+from typing import Optional
+
+import anyio
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from database import Button, IconBlob, SessionLocal
+
+UPLOAD_DIR = Path("uploads")
+RENDITIONS_DIR = UPLOAD_DIR / "renditions"
+
+# Tempo que um arquivo sem referências é mantido antes de ser apagado
+BLOB_GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+# Intervalo entre execuções da coleta de lixo
+BLOB_GC_INTERVAL_SECONDS = int(os.getenv("BLOB_GC_INTERVAL_SECONDS", "600"))
+
+_BLOB_NAME = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]{1,8})?$")
+
+
+def _icon_filename(icon: Optional[str]) -> Optional[str]:
+    """Nome do arquivo em uploads/ referenciado por um ícone, se houver"""
+    if icon and icon.startswith("/uploads/"):
+        return Path(icon).name
+    return None
+
+
+def store_blob(db: Session, data: bytes, suffix: str) -> str:
+    """
+    Grava o conteúdo em uploads/ (se ainda não existir) e registra o blob
+
+    O arquivo é escrito em um temporário e renomeado, então leitores nunca
+    veem um arquivo parcial. O registro é criado com ref_count 0 na sessão
+    informada; use set_button_icon para associá-lo a um botão. Se o blob já
+    existia sem referências, o período de carência recomeça agora.
+
+    O registro é gravado antes do arquivo: a escrita no SQLite bloqueia o
+    banco até o commit do chamador, e a coleta de lixo só apaga blobs que
+    continuam expirados dentro da sua própria transação. Assim, ou a coleta
+    termina antes (e o arquivo é gravado de novo aqui) ou não apaga o blob.
+
+    Returns:
+        str: URL do ícone (/uploads/<sha256><extensão>)
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    suffix = (suffix or "").lower()
+    if not _BLOB_NAME.match(digest + suffix):
+        suffix = ""
+    filename = f"{digest}{suffix}"
+    path = UPLOAD_DIR / filename
+
+    now = time.time()
+    db.execute(
+        insert(IconBlob)
+        .values(
+            sha256=digest,
+            filename=filename,
+            size=len(data),
+            ref_count=0,
+            released_at=now,
+        )
+        .on_conflict_do_update(
+            index_elements=[IconBlob.sha256],
+            set_={"released_at": now},
+            where=IconBlob.ref_count <= 0,
+        )
+    )
+
+    if not path.exists():
+        tmp_path = UPLOAD_DIR / f".{filename}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return f"/uploads/{filename}"
+
+
+def set_button_icon(db: Session, button: Button, icon: str):
+    """
+    Troca o ícone de um botão, ajustando as contagens de referência
+
+    As alterações ficam na sessão e são efetivadas no commit do chamador,
+    junto com a atualização do botão.
+    """
+    old_filename = _icon_filename(button.icon)
+    new_filename = _icon_filename(icon)
+    button.icon = icon
+    if old_filename == new_filename:
+        return
+
+    if new_filename:
+        db.query(IconBlob).filter(IconBlob.filename == new_filename).update(
+            {IconBlob.ref_count: IconBlob.ref_count + 1, IconBlob.released_at: None},
+            synchronize_session=False,
+        )
+
+    if old_filename:
+        released = (
+            db.query(IconBlob)
+            .filter(IconBlob.filename == old_filename, IconBlob.ref_count > 0)
+            .update(
+                {IconBlob.ref_count: IconBlob.ref_count - 1},
+                synchronize_session=False,
+            )
+        )
+        if released:
+            db.query(IconBlob).filter(
+                IconBlob.filename == old_filename, IconBlob.ref_count == 0
+            ).update({IconBlob.released_at: time.time()}, synchronize_session=False)
+        elif not _BLOB_NAME.match(old_filename):
+            # Arquivo legado (button_<pos>_<rand>), exclusivo deste botão
+            try:
+                os.remove(UPLOAD_DIR / old_filename)
+            except OSError:
+                pass
+
+
+def _remove_blob_files(filename: str):
+    match = _BLOB_NAME.match(filename)
+    try:
+        os.remove(UPLOAD_DIR / filename)
+    except OSError:
+        pass
+    # Renditions são nomeadas pelo hash (truncado) do conteúdo de origem
+    if match and RENDITIONS_DIR.exists():
+        for rendition in RENDITIONS_DIR.glob(f"{match.group(1)[:32]}_*"):
+            try:
+                os.remove(rendition)
+            except OSError:
+                pass
+
+
+def collect_garbage() -> int:
+    """
+    Remove blobs sem referências há mais de BLOB_GC_GRACE_SECONDS
+
+    Também remove arquivos <sha256> órfãos (sem registro), por exemplo de um
+    upload cujo commit falhou.
+
+    Returns:
+        int: quantidade de arquivos removidos
+    """
+    cutoff = time.time() - BLOB_GC_GRACE_SECONDS
+    removed = 0
+    db = SessionLocal()
+    try:
+        candidates = (
+            db.query(IconBlob)
+            .filter(IconBlob.ref_count <= 0, IconBlob.released_at < cutoff)
+            .all()
+        )
+        for blob in candidates:
+            # Confere se nenhum botão ainda usa o arquivo (contagem inconsistente)
+            in_use = (
+                db.query(Button)
+                .filter(Button.icon == f"/uploads/{blob.filename}")
+                .count()
+            )
+            if in_use:
+                blob.ref_count = in_use
+                blob.released_at = None
+                continue
+            # Apaga apenas se o blob continua expirado: store_blob pode ter
+            # reiniciado a carência depois da consulta acima
+            deleted = (
+                db.query(IconBlob)
+                .filter(
+                    IconBlob.id == blob.id,
+                    IconBlob.ref_count <= 0,
+                    IconBlob.released_at < cutoff,
+                )
+                .delete(synchronize_session=False)
+            )
+            if deleted:
+                _remove_blob_files(blob.filename)
+                removed += 1
+        db.commit()
+
+        known = {filename for (filename,) in db.query(IconBlob.filename).all()}
+    finally:
+        db.close()
+
+    for path in UPLOAD_DIR.iterdir():
+        if (
+            path.is_file()
+            and _BLOB_NAME.match(path.name)
+            and path.name not in known
+            and path.stat().st_mtime < cutoff
+        ):
+            _remove_blob_files(path.name)
+            removed += 1
+    return removed
+
+
+async def run_garbage_collector():
+    """Executa a coleta de lixo periodicamente, fora do event loop"""
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        try:
+            await anyio.to_thread.run_sync(collect_garbage)
+        except Exception as e:
+            print(f"Erro na coleta de lixo dos ícones: {e}")
@@ -0,0 +1,36 @@
+#!/bin/bash
+
+# Script para verificar a sintaxe do JavaScript embutido nos templates
+# Requer Node.js (usa `node --check`)
+
+if ! command -v node &> /dev/null; then
+    echo "❌ Node.js não encontrado. Instale-o para verificar os templates."
+    exit 1
+fi
+
+cd "$(dirname "$0")"
+
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf "$TMP_DIR"' EXIT
+
+STATUS=0
+for template in templates/*.html; do
+    script="$TMP_DIR/$(basename "$template" .html).js"
+    # Extrai o conteúdo dos blocos <script> sem atributo src
+    python3 - "$template" > "$script" <<'EOF'
+import re
+import sys
+
+html = open(sys.argv[1], encoding="utf-8").read()
+for match in re.finditer(r"<script(?![^>]*\bsrc=)[^>]*>(.*?)</script>", html, re.S):
+    print(match.group(1))
+EOF
+    if node --check "$script"; then
+        echo "✅ $template"
+    else
+        echo "❌ $template"
+        STATUS=1
+    fi
+done
+
+exit $STATUS
@@ -0,0 +1,762 @@
+"""
+Execução assíncrona de comandos dos botões
+
+Os comandos rodam como subprocessos assíncronos, sem bloquear o event loop
+do uvicorn. Um semáforo global limita quantos comandos rodam ao mesmo tempo, e
+cada comando roda em seu próprio grupo de processos: ao estourar o timeout, o
+grupo inteiro é encerrado, incluindo processos filhos.
+
+Comandos simples, sem metacaracteres de shell (pipes, redirecionamentos,
+variáveis, globs...), são executados diretamente, sem passar por /bin/sh: o
+argv e o caminho do executável ficam em cache, economizando um fork + exec
+do shell a cada botão pressionado. Os demais rodam via shell, como antes.
+
+A saída é lida dos pipes em pedaços e guardada com tamanho limitado por
+botão (início e fim de cada stream), como descrito em output_capture.py.
+
+Cada botão tem uma política para acionamentos enquanto o comando anterior
+ainda roda (telas resistivas costumam registrar toques duplicados):
+
+    parallel  cada acionamento inicia uma nova execução (comportamento antigo)
+    drop      acionamentos durante a execução são recusados
+    coalesce  acionamentos durante a execução viram uma única execução
+              seguinte, compartilhada por todos eles
+    queue     acionamentos entram em uma fila FIFO (até `max_queue` esperando)
+    restart   a execução atual é encerrada e o comando roda de novo
+
+Além disso, acionamentos a menos de `debounce_ms` do último aceito são
+recusados, qualquer que seja a política. Execuções com a saída em tempo real
+(stream_execution) passam pelas mesmas regras.
+"""
+import asyncio
+import os
+import secrets
+import shlex
+import shutil
+import signal
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from execution_log import ExecutionRecord, execution_log_writer, truncate_output
+from metrics import FAST_BUCKETS, gauge, gauge_func, histogram
+from output_capture import (
+    DEFAULT_OUTPUT_LIMIT,
+    OutputCapture,
+    capture_pipe,
+    new_output_id,
+    spill_path,
+)
+
+# Máximo de comandos executando simultaneamente
+COMMAND_CONCURRENCY = int(os.getenv("COMMAND_CONCURRENCY", "4"))
+
+# Timeout padrão (segundos) para botões sem timeout configurado
+DEFAULT_COMMAND_TIMEOUT = 30
+MAX_COMMAND_TIMEOUT = 600
+
+# Histórico de jobs assíncronos: quantidade máxima e tempo de retenção
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "256"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "600"))
+
+# Criado no event loop, no primeiro uso (ver _command_semaphore)
+_semaphore: Optional[asyncio.Semaphore] = None
+
+# Caracteres que exigem o shell. Aspas são permitidas: sem `$`, crase e `\`,
+# o shlex separa os argumentos exatamente como o /bin/sh faria
+SHELL_METACHARACTERS = frozenset("|&;<>()$`\\*?[]{}~#!\n")
+
+# Builtins que só fazem sentido dentro do shell
+SHELL_BUILTINS = frozenset(
+    {
+        ".",
+        "alias",
+        "cd",
+        "command",
+        "eval",
+        "exec",
+        "exit",
+        "export",
+        "read",
+        "set",
+        "source",
+        "trap",
+        "ulimit",
+        "umask",
+        "unset",
+    }
+)
+
+# Quantidade de comandos distintos com argv e executável em cache
+EXEC_CACHE_SIZE = 1024
+
+# Políticas para acionamentos de um botão enquanto o comando anterior roda
+CONCURRENCY_POLICIES = ("parallel", "drop", "coalesce", "queue", "restart")
+DEFAULT_CONCURRENCY_POLICY = "parallel"
+DEFAULT_MAX_QUEUE = 4
+MAX_QUEUE_LIMIT = 32
+MAX_DEBOUNCE_MS = 10_000
+
+# Streaming da saída: maior linha enviada de uma vez e quantos pedaços lidos
+# dos pipes podem aguardar o cliente antes de pausar a leitura
+STREAM_MAX_LINE = 16 * 1024
+STREAM_QUEUE_SIZE = 16
+
+
+COMMAND_SPAWN_SECONDS = histogram(
+    "cyd_command_spawn_duration_seconds",
+    "Tempo para iniciar o subprocesso (direto ou via /bin/sh)",
+    ("mode",),
+    FAST_BUCKETS,
+)
+COMMAND_DURATION_SECONDS = histogram(
+    "cyd_command_duration_seconds",
+    "Duração dos comandos, do início do subprocesso ao fim da saída",
+    ("status",),
+)
+COMMANDS_RUNNING = gauge("cyd_commands_running", "Comandos em execução")
+COMMANDS_WAITING = gauge(
+    "cyd_commands_waiting", "Comandos aguardando um slot de COMMAND_CONCURRENCY"
+)
+
+
+class CommandTimeoutError(Exception):
+    """O comando excedeu o tempo limite e foi encerrado"""
+
+
+class JobStoreFullError(Exception):
+    """Todos os slots do histórico estão ocupados por jobs em andamento"""
+
+
+class ExecutionRejectedError(Exception):
+    """O acionamento foi recusado ou substituído pela política do botão"""
+
+
+@dataclass(frozen=True)
+class ButtonCommand:
+    """Comando de um botão e as configurações da sua execução"""
+
+    position: int
+    command: str
+    timeout: float = DEFAULT_COMMAND_TIMEOUT
+    output_limit: int = DEFAULT_OUTPUT_LIMIT
+    policy: str = DEFAULT_CONCURRENCY_POLICY
+    debounce_ms: int = 0
+    max_queue: int = DEFAULT_MAX_QUEUE
+
+
+@dataclass
+class CommandResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    stdout_dropped: int = 0
+    stderr_dropped: int = 0
+    # stream -> URL da saída completa, para streams que passaram do limite
+    output_files: Dict[str, str] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "success": self.returncode == 0,
+            "stdout": self.stdout,
+            "stderr": self.stderr,
+            "returncode": self.returncode,
+            "stdout_dropped_bytes": self.stdout_dropped,
+            "stderr_dropped_bytes": self.stderr_dropped,
+            "output_files": self.output_files,
+        }
+
+
+def _kill_process_group(process: asyncio.subprocess.Process):
+    """Encerra o grupo de processos do comando (shell e filhos)"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+@lru_cache(maxsize=EXEC_CACHE_SIZE)
+def direct_exec_argv(command: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """
+    (executável, argv) para executar o comando sem shell, ou None se ele
+    precisar do shell
+
+    O executável já vem resolvido para o caminho absoluto (via PATH); argv[0]
+    continua como escrito, então mensagens de erro do programa não mudam.
+    """
+    if any(char in SHELL_METACHARACTERS for char in command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if not argv or "=" in argv[0] or argv[0] in SHELL_BUILTINS:
+        return None
+
+    program = argv[0]
+    if "/" in program:
+        # Caminhos relativos dependem do diretório de trabalho do shell
+        if not os.path.isabs(program) or not os.access(program, os.X_OK):
+            return None
+        executable = program
+    else:
+        executable = shutil.which(program)
+        if executable is None:
+            return None
+    return executable, tuple(argv)
+
+
+async def _spawn(command: str) -> asyncio.subprocess.Process:
+    """Inicia o comando, diretamente quando possível ou via shell"""
+    options = dict(
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=os.path.expanduser("~"),  # Executa no diretório home do usuário
+        start_new_session=True,  # Grupo de processos próprio
+    )
+    direct = direct_exec_argv(command)
+    if direct is not None:
+        executable, argv = direct
+        try:
+            with COMMAND_SPAWN_SECONDS.time("direct"):
+                return await asyncio.create_subprocess_exec(
+                    *argv, executable=executable, **options
+                )
+        except OSError:
+            # Executável removido ou alterado desde que entrou no cache
+            direct_exec_argv.cache_clear()
+    with COMMAND_SPAWN_SECONDS.time("shell"):
+        return await asyncio.create_subprocess_shell(command, **options)
+
+
+def _command_semaphore() -> asyncio.Semaphore:
+    """
+    Semáforo global de execução
+
+    No Python 3.9 o semáforo fica preso ao loop em que foi criado, e o módulo
+    é importado antes do loop do uvicorn existir; por isso ele é criado aqui.
+    """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(COMMAND_CONCURRENCY)
+    return _semaphore
+
+
+@asynccontextmanager
+async def _command_slot():
+    """Aguarda um slot do semáforo global, contando espera e execução"""
+    semaphore = _command_semaphore()
+    COMMANDS_WAITING.inc()
+    try:
+        await semaphore.acquire()
+    finally:
+        COMMANDS_WAITING.dec()
+    COMMANDS_RUNNING.inc()
+    try:
+        yield
+    finally:
+        COMMANDS_RUNNING.dec()
+        semaphore.release()
+
+
+async def _capture_output(
+    process: asyncio.subprocess.Process,
+    stdout: OutputCapture,
+    stderr: OutputCapture,
+    listeners: List[asyncio.Queue],
+):
+    """
+    Lê stdout e stderr até o fim e espera o processo terminar
+
+    Cada pedaço lido também é colocado, como (stream, bytes), nas filas de
+    `listeners`. A lista é consultada a cada pedaço, então ouvintes podem
+    entrar e sair durante a execução.
+    """
+
+    def forward(name: str):
+        async def on_chunk(chunk: bytes):
+            for listener in list(listeners):
+                await listener.put((name, chunk))
+
+        return on_chunk
+
+    await asyncio.gather(
+        capture_pipe(process.stdout, stdout, forward("stdout") if listeners else None),
+        capture_pipe(process.stderr, stderr, forward("stderr") if listeners else None),
+        process.wait(),
+    )
+
+
+async def run_command(
+    command: str,
+    timeout: float,
+    on_start: Optional[Callable[[], None]] = None,
+    output_limit: int = DEFAULT_OUTPUT_LIMIT,
+    listeners: Optional[List[asyncio.Queue]] = None,
+) -> CommandResult:
+    """
+    Executa um comando sem bloquear o event loop
+
+    Args:
+        command: Comando a executar
+        timeout: Tempo limite em segundos
+        on_start: Chamada quando o comando obtém um slot e começa a rodar
+        output_limit: Bytes de stdout e de stderr mantidos em memória (início
+            e fim da saída); o restante vai para um arquivo temporário
+        listeners: Filas que recebem a saída em tempo real (ver
+            stream_execution)
+
+    Raises:
+        CommandTimeoutError: se o comando exceder `timeout` segundos
+    """
+    output_id = new_output_id()
+    stdout = OutputCapture(output_limit, spill_path(output_id, "stdout"))
+    stderr = OutputCapture(output_limit, spill_path(output_id, "stderr"))
+    async with _command_slot():
+        if on_start:
+            on_start()
+        start = time.perf_counter()
+        status = "error"
+        process = await _spawn(command)
+        try:
+            await asyncio.wait_for(
+                _capture_output(
+                    process, stdout, stderr, listeners if listeners is not None else []
+                ),
+                timeout,
+            )
+            status = "finished"
+        except asyncio.TimeoutError:
+            status = "timeout"
+            _kill_process_group(process)
+            await process.wait()
+            raise CommandTimeoutError()
+        except asyncio.CancelledError:
+            status = "cancelled"
+            _kill_process_group(process)
+            raise
+        finally:
+            stdout.close()
+            stderr.close()
+            COMMAND_DURATION_SECONDS.observe(time.perf_counter() - start, status)
+
+    return CommandResult(
+        returncode=process.returncode,
+        stdout=stdout.text(),
+        stderr=stderr.text(),
+        stdout_dropped=stdout.dropped,
+        stderr_dropped=stderr.dropped,
+        output_files={
+            name: f"/api/outputs/{output_id}/{name}"
+            for name, capture in (("stdout", stdout), ("stderr", stderr))
+            if capture.has_spill
+        },
+    )
+
+
+@dataclass
+class _ScheduledRun:
+    task: Optional[asyncio.Task] = None
+    started: bool = False
+    on_start: List[Callable[[], None]] = field(default_factory=list)
+    # Filas dos clientes que recebem a saída em tempo real
+    listeners: List[asyncio.Queue] = field(default_factory=list)
+    # Acionamentos atendidos por esta execução (mais de um com `coalesce`)
+    presses: int = 1
+
+    def mark_started(self):
+        self.started = True
+        for callback in self.on_start:
+            callback()
+
+
+@dataclass
+class _ButtonState:
+    last_accepted: float = float("-inf")
+    # Execuções ainda não concluídas, em ordem (as primeiras podem estar rodando)
+    runs: Deque[_ScheduledRun] = field(default_factory=deque)
+
+
+async def _run_and_log(
+    button: ButtonCommand, run: _ScheduledRun, api_key_id: Optional[int]
+) -> CommandResult:
+    """Executa o comando do botão e registra a execução no histórico"""
+    started_at = None
+    started = 0.0
+
+    def mark_started():
+        nonlocal started_at, started
+        started_at = time.time()
+        started = time.perf_counter()
+        run.mark_started()
+
+    status = "failed"
+    result = None
+    try:
+        result = await run_command(
+            button.command,
+            button.timeout,
+            on_start=mark_started,
+            output_limit=button.output_limit,
+            listeners=run.listeners,
+        )
+        status = "finished"
+        return result
+    except CommandTimeoutError:
+        status = "timeout"
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        if started_at is not None:
+            execution_log_writer.record(
+                ExecutionRecord(
+                    position=button.position,
+                    api_key_id=api_key_id,
+                    started_at=started_at,
+                    duration_ms=(time.perf_counter() - started) * 1000,
+                    status=status,
+                    returncode=result.returncode if result else None,
+                    stdout=truncate_output(result.stdout) if result else "",
+                    stderr=truncate_output(result.stderr) if result else "",
+                )
+            )
+
+
+class ButtonScheduler:
+    """Aplica a política de concorrência e o debounce de cada botão"""
+
+    def __init__(self):
+        self._states: Dict[int, _ButtonState] = {}
+
+    @property
+    def waiting(self) -> int:
+        """
+        Execuções agendadas que ainda não começaram (todos os botões)
+
+        Uma execução só começa quando obtém um slot de COMMAND_CONCURRENCY;
+        até lá ela conta como na fila, mesmo sem outra execução do botão à
+        frente.
+        """
+        return sum(
+            1
+            for state in self._states.values()
+            for run in state.runs
+            if not run.started
+        )
+
+    def submit(
+        self,
+        button: ButtonCommand,
+        on_start: Optional[Callable[[], None]] = None,
+        api_key_id: Optional[int] = None,
+        listener: Optional[asyncio.Queue] = None,
+    ) -> asyncio.Task:
+        """
+        Agenda a execução do comando do botão conforme a sua política
+
+        A decisão é tomada na hora: o acionamento é recusado (exceção) ou
+        recebe a task da execução que vai atendê-lo, para ser aguardada com
+        `wait_execution`. Com `coalesce`, vários acionamentos recebem a mesma
+        task.
+
+        Cada execução é registrada no histórico (execution_log.py); com
+        `coalesce`, os acionamentos agrupados geram um único registro.
+
+        Args:
+            on_start: Chamada quando a execução obtém um slot e começa a rodar
+            api_key_id: API key que acionou o botão (None para o painel)
+            listener: Fila que recebe a saída em tempo real; quem a informa
+                deve chamar `detach` ao terminar (ver stream_execution)
+
+        Raises:
+            ExecutionRejectedError: debounce, `drop` com o comando rodando ou
+                fila de `queue` cheia
+        """
+        state = self._states.setdefault(button.position, _ButtonState())
+        now = time.monotonic()
+        if now - state.last_accepted < button.debounce_ms / 1000:
+            raise ExecutionRejectedError("Acionamento repetido ignorado (debounce)")
+
+        previous = state.runs[-1] if state.runs else None
+        policy = button.policy
+        if previous is None or policy == "parallel":
+            after = None
+        elif policy == "drop":
+            raise ExecutionRejectedError("O comando do botão ainda está em execução")
+        elif policy == "coalesce" and not previous.started:
+            # Já existe uma execução seguinte aguardando: junta-se a ela
+            state.last_accepted = now
+            if on_start:
+                previous.on_start.append(on_start)
+            if listener is not None:
+                previous.listeners.append(listener)
+            previous.presses += 1
+            return previous.task
+        elif policy == "queue":
+            # Conta também a execução que só espera um slot global
+            waiting = sum(1 for run in state.runs if not run.started)
+            if waiting >= button.max_queue:
+                raise ExecutionRejectedError("Fila de execuções do botão cheia")
+            after = previous.task
+        else:
+            if policy == "restart":
+                for run in state.runs:
+                    run.task.cancel()
+            after = previous.task
+
+        state.last_accepted = now
+        run = _ScheduledRun(
+            on_start=[on_start] if on_start else [],
+            listeners=[listener] if listener is not None else [],
+        )
+
+        async def execute() -> CommandResult:
+            if after is not None:
+                await asyncio.wait([after])
+            return await _run_and_log(button, run, api_key_id)
+
+        def finished(task: asyncio.Task):
+            state.runs.remove(run)
+            # Evita o aviso de exceção não lida quando ninguém mais aguarda
+            if not task.cancelled():
+                task.exception()
+
+        run.task = asyncio.create_task(execute())
+        run.task.add_done_callback(finished)
+        state.runs.append(run)
+        return run.task
+
+    def detach(self, position: int, task: asyncio.Task, listener: asyncio.Queue):
+        """
+        Remove o ouvinte de uma execução (cliente do streaming desconectou)
+
+        Se nenhum outro acionamento depende da execução, ela é cancelada e o
+        comando encerrado.
+        """
+        state = self._states.get(position)
+        for run in state.runs if state else ():
+            if run.task is task:
+                if listener in run.listeners:
+                    run.listeners.remove(listener)
+                run.presses -= 1
+                if run.presses <= 0:
+                    task.cancel()
+                break
+        # Libera a leitura do pipe, caso esteja bloqueada na fila cheia
+        while not listener.empty():
+            listener.get_nowait()
+
+
+async def wait_execution(task: asyncio.Task) -> CommandResult:
+    """
+    Aguarda uma execução agendada por ButtonScheduler.submit
+
+    Se quem aguarda for cancelado, a execução continua (ela pode estar
+    atendendo outros acionamentos).
+
+    Raises:
+        ExecutionRejectedError: se a execução foi encerrada por um acionamento
+            posterior (política `restart`)
+        CommandTimeoutError: se o comando exceder o tempo limite
+    """
+    # asyncio.wait não cancela a task se quem aguarda for cancelado; nesse
+    # caso o CancelledError sobe daqui e a execução segue
+    await asyncio.wait([task])
+    if task.cancelled():
+        raise ExecutionRejectedError(
+            "Execução substituída por um novo acionamento do botão"
+        )
+    return task.result()
+
+
+def _split_lines(pending: bytes, chunk: bytes) -> Tuple[List[bytes], bytes]:
+    """Separa as linhas completas de pending + chunk; retorna (linhas, resto)"""
+    *lines, pending = (pending + chunk).split(b"\n")
+    # Linhas muito longas são enviadas em pedaços
+    while len(pending) >= STREAM_MAX_LINE:
+        lines.append(pending[:STREAM_MAX_LINE])
+        pending = pending[STREAM_MAX_LINE:]
+    return lines, pending
+
+
+async def stream_execution(
+    task: asyncio.Task, listener: asyncio.Queue
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Produz a saída de uma execução agendada linha a linha, enquanto é gerada
+
+    `listener` é a fila informada em ButtonScheduler.submit. Produz
+    ("stdout", str) e ("stderr", str) para cada linha (sem o "\\n") e, por
+    fim, ("exit", CommandResult). A fila é limitada: se o cliente for lento, a
+    leitura pausa e o processo bloqueia na escrita, então a saída nunca é
+    acumulada inteira em memória.
+
+    Raises:
+        CommandTimeoutError: se o comando exceder o tempo limite
+        ExecutionRejectedError: se a execução foi substituída (`restart`)
+    """
+    pending = {"stdout": b"", "stderr": b""}
+    get = None
+    try:
+        while True:
+            get = asyncio.ensure_future(listener.get())
+            await asyncio.wait([get, task], return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                break
+            name, chunk = get.result()
+            lines, pending[name] = _split_lines(pending[name], chunk)
+            for line in lines:
+                yield name, line.decode("utf-8", errors="replace")
+        # A execução terminou: entrega o que ficou na fila e as linhas sem "\n"
+        while not listener.empty():
+            name, chunk = listener.get_nowait()
+            lines, pending[name] = _split_lines(pending[name], chunk)
+            for line in lines:
+                yield name, line.decode("utf-8", errors="replace")
+        for name, rest in pending.items():
+            if rest:
+                yield name, rest.decode("utf-8", errors="replace")
+        yield "exit", await wait_execution(task)
+    finally:
+        if get is not None:
+            get.cancel()
+
+
+button_scheduler = ButtonScheduler()
+
+gauge_func(
+    "cyd_scheduled_executions_waiting",
+    "Acionamentos aguardando a execução anterior do botão (coalesce/queue)",
+    lambda: button_scheduler.waiting,
+)
+
+
+@dataclass
+class Job:
+    id: str
+    position: int
+    status: str = "pending"  # pending | running | finished | timeout | failed
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    finished_at: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    expires_at: Optional[float] = None  # time.monotonic() para evicção
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status not in ("pending", "running")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "position": self.position,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """
+    Histórico limitado de execuções assíncronas
+
+    Funciona como um buffer circular: guarda no máximo `capacity` jobs e
+    descarta primeiro os concluídos mais antigos ou expirados (TTL contado a
+    partir do fim da execução). Se todos os slots estiverem ocupados por jobs
+    em andamento, novos jobs são recusados, mantendo a memória constante.
+    """
+
+    def __init__(self, capacity: int = JOB_HISTORY_SIZE, ttl: int = JOB_TTL_SECONDS):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for job_id in [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.expires_at is not None and job.expires_at <= now
+        ]:
+            del self._jobs[job_id]
+
+        if len(self._jobs) < self.capacity:
+            return
+        for job_id, job in self._jobs.items():
+            if job.done:
+                del self._jobs[job_id]
+                return
+        raise JobStoreFullError()
+
+    def submit(self, button: ButtonCommand, api_key_id: Optional[int] = None) -> Job:
+        """
+        Agenda a execução do comando e retorna o job imediatamente
+
+        Raises:
+            JobStoreFullError: se não houver slot livre no histórico
+            ExecutionRejectedError: se a política do botão recusar o acionamento
+        """
+        self._evict()
+        job = Job(id=secrets.token_urlsafe(12), position=button.position)
+
+        def mark_running():
+            job.status = "running"
+
+        execution = button_scheduler.submit(
+            button, on_start=mark_running, api_key_id=api_key_id
+        )
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, execution))
+        return job
+
+    @property
+    def active(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.done)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job and job.expires_at is not None and job.expires_at <= time.monotonic():
+            del self._jobs[job_id]
+            return None
+        return job
+
+    async def _run(self, job: Job, execution: asyncio.Task):
+        try:
+            result = await wait_execution(execution)
+            job.result = result.to_dict()
+            job.status = "finished"
+        except CommandTimeoutError:
+            job.status = "timeout"
+            job.error = "Comando excedeu o tempo limite"
+        except ExecutionRejectedError as e:
+            job.status = "failed"
+            job.error = str(e)
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "Execução cancelada"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"Erro ao executar comando: {str(e)}"
+        finally:
+            job.finished_at = datetime.now().isoformat()
+            job.expires_at = time.monotonic() + self.ttl
+            job.task = None
+
+
+job_store = JobStore()
+
+gauge_func(
+    "cyd_jobs_active",
+    "Jobs assíncronos pendentes ou em execução",
+    lambda: job_store.active,
+)
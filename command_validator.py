@@ -1,8 +1,11 @@
 """
 Sistema de proteção contra comandos perigosos
 """
+import os
 import re
-from typing import Tuple
+import shlex
+from functools import lru_cache
+from typing import List, Tuple
 
 # Lista de comandos perigosos que não podem ser executados
 DANGEROUS_COMMANDS = [
@@ -42,6 +45,54 @@ DANGEROUS_PATTERNS = [
 ]
 
 
+# Todos os padrões compilados em uma única alternação; cada padrão vira um
+# grupo nomeado para que o motivo da recusa continue indicando o padrão
+_DANGEROUS_REGEX = re.compile(
+    "|".join(f"(?P<p{i}>{pattern})" for i, pattern in enumerate(DANGEROUS_PATTERNS)),
+    re.IGNORECASE,
+)
+_SYSTEM_REDIRECT_REGEX = re.compile(r">\s*(/etc|/bin|/sbin|/usr/bin|/usr/sbin|/System)")
+_WHITESPACE_REGEX = re.compile(r"\s+")
+
+_DANGEROUS_COMMAND_SET = frozenset(DANGEROUS_COMMANDS)
+
+# Separadores entre comandos no shell (;, &&, ||, |, &)
+_COMMAND_SEPARATORS = frozenset({";", "&&", "||", "|", "&", ";;", "|&"})
+
+# Quantidade de comandos distintos com validação memorizada
+VALIDATION_CACHE_SIZE = 1024
+
+
+def _command_words(command: str) -> List[str]:
+    """
+    Nome do programa de cada comando de uma linha de shell
+
+    Usa shlex, então aspas não escondem o nome (`'rm' -rf`) e comandos
+    encadeados (`echo a; rm b`) também são verificados. Caminhos são
+    reduzidos ao nome do arquivo (`/bin/rm` -> `rm`).
+    """
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        # Aspas sem fechamento: recorre à separação simples por espaços
+        tokens = command.split()
+
+    words = []
+    expect_command = True
+    for token in tokens:
+        if token in _COMMAND_SEPARATORS:
+            expect_command = True
+            continue
+        if expect_command:
+            word = os.path.basename(token)
+            words.append(word)
+            # `sudo <programa>`: verifica também o programa
+            expect_command = word == "sudo"
+    return words
+
+
 def is_command_dangerous(command: str) -> Tuple[bool, str]:
     """
     Verifica se um comando é perigoso
@@ -55,32 +106,37 @@ def is_command_dangerous(command: str) -> Tuple[bool, str]:
         return True, "Comando vazio não é permitido"
     
     # Remove espaços extras
-    command = re.sub(r'\s+', ' ', command)
+    command = _WHITESPACE_REGEX.sub(" ", command)
     
     # Verifica comandos perigosos exatos
-    first_word = command.split()[0] if command.split() else ""
-    if first_word.lower() in DANGEROUS_COMMANDS:
-        return True, f"Comando '{first_word}' não é permitido por questões de segurança"
+    for word in _command_words(command):
+        if word.lower() in _DANGEROUS_COMMAND_SET:
+            return True, f"Comando '{word}' não é permitido por questões de segurança"
     
     # Verifica padrões perigosos
-    for pattern in DANGEROUS_PATTERNS:
-        if re.search(pattern, command, re.IGNORECASE):
-            return True, f"Comando contém padrão perigoso: {pattern}"
+    match = _DANGEROUS_REGEX.search(command)
+    if match:
+        pattern = DANGEROUS_PATTERNS[int(match.lastgroup[1:])]
+        return True, f"Comando contém padrão perigoso: {pattern}"
     
     # Verifica se contém pipes ou redirecionamentos perigosos
     if "|" in command and any(cmd in command.lower() for cmd in ["rm", "shutdown", "dd"]):
         return True, "Comandos perigosos não podem ser usados com pipes"
     
     # Verifica redirecionamento para arquivos do sistema
-    if re.search(r">\s*(/etc|/bin|/sbin|/usr/bin|/usr/sbin|/System)", command):
+    if _SYSTEM_REDIRECT_REGEX.search(command):
         return True, "Redirecionamento para diretórios do sistema não é permitido"
     
     return False, ""
 
 
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
 def validate_command(command: str) -> Tuple[bool, str]:
     """
     Valida um comando antes de executá-lo
+
+    O resultado é memorizado pelo texto do comando, então validar de novo o
+    comando já salvo de um botão (a cada execução) não custa nada.
     
     Returns:
         (is_valid, error_message)
@@ -93,4 +149,3 @@ def validate_command(command: str) -> Tuple[bool, str]:
         return False, reason
     
     return True, ""
-
@@ -1,15 +1,25 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text
+from sqlalchemy import create_engine, Column, Float, Integer, String, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+from typing import Dict
 import os
 
+from metrics import instrument_engine
+
 DATABASE_URL = "sqlite:///./stream_deck.db"
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Snapshot em memória de SetupStatus e Config, carregado no init_db e
+# atualizado (write-through) por complete_setup e set_config_value.
+# Os dicionários nunca são modificados no lugar, apenas substituídos.
+_setup_completed = False
+_config_values: Dict[str, str] = {}
+
 
 class Button(Base):
     __tablename__ = "buttons"
@@ -20,6 +30,12 @@ class Button(Base):
     background_color = Column(String, default="#3B82F6")  # Cor em hex
     command = Column(Text, nullable=False)  # Comando a ser executado
     label = Column(String, default="")  # Label opcional para o botão
+    timeout = Column(Integer, default=30)  # Timeout do comando em segundos
+    output_limit = Column(Integer, default=65536)  # Bytes de saída em memória
+    # Acionamentos durante a execução: parallel, drop, coalesce, queue, restart
+    concurrency_policy = Column(String, default="parallel")
+    debounce_ms = Column(Integer, default=0)  # Ignora acionamentos repetidos
+    max_queue = Column(Integer, default=4)  # Execuções esperando na política queue
 
 
 class User(Base):
@@ -34,7 +50,8 @@ class ApiKey(Base):
     __tablename__ = "api_keys"
     
     id = Column(Integer, primary_key=True, index=True)
-    key = Column(String, unique=True, nullable=False, index=True)
+    key = Column(String, unique=True, nullable=False, index=True)  # Prefixo mascarado
+    key_hash = Column(String, index=True)  # SHA-256 (hex) da chave completa
     name = Column(String, default="")  # Nome descritivo da chave
     created_at = Column(String, default="")  # Timestamp de criação
     is_active = Column(Integer, default=1)  # 1 = ativa, 0 = desativada
@@ -48,6 +65,31 @@ class Config(Base):
     value = Column(Text, nullable=False)
 
 
+class IconBlob(Base):
+    __tablename__ = "icon_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String, unique=True, nullable=False, index=True)
+    filename = Column(String, unique=True, nullable=False)  # <sha256><extensão>
+    size = Column(Integer, default=0)
+    ref_count = Column(Integer, default=0)  # Botões usando este arquivo
+    released_at = Column(Float, nullable=True)  # Quando ref_count chegou a 0
+
+
+class ExecutionLog(Base):
+    __tablename__ = "execution_logs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    position = Column(Integer, nullable=False, index=True)
+    api_key_id = Column(Integer, nullable=True)  # None quando veio do painel (JWT)
+    started_at = Column(Float, nullable=False, index=True)  # Epoch em segundos
+    duration_ms = Column(Float, nullable=False)
+    status = Column(String, nullable=False)  # finished, timeout, failed, cancelled
+    returncode = Column(Integer, nullable=True)
+    stdout = Column(Text, default="")  # Truncado
+    stderr = Column(Text, default="")  # Truncado
+
+
 class SetupStatus(Base):
     __tablename__ = "setup_status"
     
@@ -56,9 +98,40 @@ class SetupStatus(Base):
     completed_at = Column(String, default="")
 
 
+# Colunas adicionadas depois da criação inicial das tabelas
+# (create_all não altera tabelas já existentes)
+COLUMN_MIGRATIONS = {
+    "buttons": {
+        "timeout": "INTEGER DEFAULT 30",
+        "output_limit": "INTEGER DEFAULT 65536",
+        "concurrency_policy": "VARCHAR DEFAULT 'parallel'",
+        "debounce_ms": "INTEGER DEFAULT 0",
+        "max_queue": "INTEGER DEFAULT 4",
+    },
+    "api_keys": {
+        "key_hash": "VARCHAR",
+    },
+}
+
+
+def migrate_columns():
+    """Adiciona colunas novas em bancos criados por versões anteriores"""
+    with engine.begin() as conn:
+        for table, columns in COLUMN_MIGRATIONS.items():
+            existing = {
+                row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")
+            }
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"
+                    )
+
+
 def init_db():
     """Inicializa o banco de dados criando as tabelas"""
     Base.metadata.create_all(bind=engine)
+    migrate_columns()
     
     # Inicializa configurações padrão
     db = SessionLocal()
@@ -85,19 +158,33 @@ def init_db():
     finally:
         db.close()
 
+    load_settings_cache()
 
-def get_config_value(key: str, default: str = "") -> str:
-    """Obtém valor de configuração"""
+
+def load_settings_cache():
+    """Carrega SetupStatus e Config do banco para a memória"""
+    global _setup_completed, _config_values
     db = SessionLocal()
     try:
-        config = db.query(Config).filter(Config.key == key).first()
-        return config.value if config else default
+        setup = db.query(SetupStatus).first()
+        config_values = {
+            config.key: config.value for config in db.query(Config).all()
+        }
     finally:
         db.close()
 
+    _config_values = config_values
+    _setup_completed = setup.is_completed == 1 if setup else False
+
+
+def get_config_value(key: str, default: str = "") -> str:
+    """Obtém valor de configuração (do snapshot em memória)"""
+    return _config_values.get(key, default)
+
 
 def set_config_value(key: str, value: str):
     """Define valor de configuração"""
+    global _config_values
     db = SessionLocal()
     try:
         config = db.query(Config).filter(Config.key == key).first()
@@ -110,19 +197,17 @@ def set_config_value(key: str, value: str):
     finally:
         db.close()
 
+    _config_values = {**_config_values, key: value}
+
 
 def is_setup_completed() -> bool:
-    """Verifica se o setup foi completado"""
-    db = SessionLocal()
-    try:
-        setup = db.query(SetupStatus).first()
-        return setup.is_completed == 1 if setup else False
-    finally:
-        db.close()
+    """Verifica se o setup foi completado (do snapshot em memória)"""
+    return _setup_completed
 
 
 def complete_setup():
     """Marca o setup como completado"""
+    global _setup_completed
     db = SessionLocal()
     try:
         setup = db.query(SetupStatus).first()
@@ -136,6 +221,8 @@ def complete_setup():
     finally:
         db.close()
 
+    _setup_completed = True
+
 
 def get_db():
     """Dependency para obter sessão do banco"""
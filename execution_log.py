@@ -0,0 +1,213 @@
+"""
+Histórico de execuções dos comandos, gravado em segundo plano
+
+Cada execução gera um registro (botão, API key, início, duração, código de
+saída e o começo da saída) que entra em uma fila em memória; uma tarefa de
+segundo plano grava a fila no SQLite em lotes, com um único commit por lote.
+Assim o acionamento nunca espera pelo banco. Se a fila encher (banco muito
+lento), os registros excedentes são descartados e contados em `dropped`.
+
+Registros mais antigos que EXECUTION_LOG_RETENTION_DAYS são apagados
+periodicamente.
+"""
+import asyncio
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+import anyio
+from sqlalchemy import insert
+
+from database import ExecutionLog, SessionLocal
+from metrics import counter_func, gauge_func
+
+# Registros por commit e espera máxima para juntar um lote
+EXECUTION_LOG_BATCH_SIZE = int(os.getenv("EXECUTION_LOG_BATCH_SIZE", "200"))
+EXECUTION_LOG_FLUSH_SECONDS = float(os.getenv("EXECUTION_LOG_FLUSH_SECONDS", "2"))
+# Registros aguardando gravação antes de começar a descartar
+EXECUTION_LOG_QUEUE_SIZE = int(os.getenv("EXECUTION_LOG_QUEUE_SIZE", "10000"))
+EXECUTION_LOG_RETENTION_DAYS = int(os.getenv("EXECUTION_LOG_RETENTION_DAYS", "30"))
+
+# Caracteres de stdout/stderr guardados por execução
+EXECUTION_LOG_OUTPUT_CHARS = 1024
+
+_PRUNE_INTERVAL_SECONDS = 3600
+
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass(frozen=True)
+class ExecutionRecord:
+    position: int
+    api_key_id: Optional[int]
+    started_at: float
+    duration_ms: float
+    status: str
+    returncode: Optional[int] = None
+    stdout: str = ""
+    stderr: str = ""
+
+
+def truncate_output(text: str) -> str:
+    return text[:EXECUTION_LOG_OUTPUT_CHARS]
+
+
+class ExecutionLogWriter:
+    """Fila write-behind dos registros de execução"""
+
+    def __init__(self):
+        # Criada no event loop, no primeiro uso: no Python 3.9 a fila fica
+        # presa ao loop em que foi criada, e o módulo é importado antes do
+        # loop do uvicorn existir
+        self._queue: "Optional[asyncio.Queue[ExecutionRecord]]" = None
+        # Lote retirado da fila e ainda não entregue ao banco
+        self._batch: List[ExecutionRecord] = []
+        self._last_prune = 0.0
+        self.dropped = 0
+
+    def _get_queue(self) -> "asyncio.Queue[ExecutionRecord]":
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=EXECUTION_LOG_QUEUE_SIZE)
+        return self._queue
+
+    @property
+    def pending(self) -> int:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._batch)
+
+    def record(self, record: ExecutionRecord):
+        """Enfileira um registro sem bloquear"""
+        try:
+            self._get_queue().put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _drain(self):
+        if self._queue is None:
+            return
+        while len(self._batch) < EXECUTION_LOG_BATCH_SIZE:
+            try:
+                self._batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+    def _take_batch(self) -> List[ExecutionRecord]:
+        batch, self._batch = self._batch, []
+        return batch
+
+    def _write(self, batch: List[ExecutionRecord]):
+        db = SessionLocal()
+        try:
+            db.execute(insert(ExecutionLog), [asdict(record) for record in batch])
+            now = time.time()
+            if now - self._last_prune >= _PRUNE_INTERVAL_SECONDS:
+                self._last_prune = now
+                cutoff = now - EXECUTION_LOG_RETENTION_DAYS * 86400
+                db.query(ExecutionLog).filter(ExecutionLog.started_at < cutoff).delete(
+                    synchronize_session=False
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    async def run(self):
+        """Grava a fila em lotes, fora do event loop"""
+        queue = self._get_queue()
+        while True:
+            self._batch.append(await queue.get())
+            if queue.qsize() < EXECUTION_LOG_BATCH_SIZE:
+                # Espera mais registros para gravar tudo em um commit
+                await asyncio.sleep(EXECUTION_LOG_FLUSH_SECONDS)
+            self._drain()
+            batch = self._take_batch()
+            try:
+                await anyio.to_thread.run_sync(self._write, batch)
+            except Exception as e:
+                print(f"Erro ao gravar o histórico de execuções: {e}")
+
+    def flush(self):
+        """Grava de forma síncrona tudo o que está pendente (no shutdown)"""
+        while True:
+            self._drain()
+            batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Erro ao gravar o histórico de execuções: {e}")
+                return
+
+
+def _percentile(sorted_values: List[float], percentile: int) -> float:
+    """Percentil pelo método nearest-rank"""
+    rank = max(-(-len(sorted_values) * percentile // 100), 1)
+    return sorted_values[rank - 1]
+
+
+def execution_stats(since: float) -> List[Dict]:
+    """
+    Contagens e latências (p50/p95/p99) por botão desde `since` (epoch)
+
+    O SQLite não tem função de percentil, então as durações vêm ordenadas do
+    banco e os percentis são calculados aqui.
+    """
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(
+                ExecutionLog.position,
+                ExecutionLog.duration_ms,
+                ExecutionLog.status,
+                ExecutionLog.returncode,
+            )
+            .filter(ExecutionLog.started_at >= since)
+            .order_by(ExecutionLog.position, ExecutionLog.duration_ms)
+            .all()
+        )
+    finally:
+        db.close()
+
+    by_position: Dict[int, Dict] = {}
+    for position, duration_ms, status, returncode in rows:
+        stats = by_position.setdefault(
+            position, {"durations": [], "failures": 0, "timeouts": 0}
+        )
+        stats["durations"].append(duration_ms)
+        if status == "timeout":
+            stats["timeouts"] += 1
+        elif status != "finished" or returncode != 0:
+            stats["failures"] += 1
+
+    result = []
+    for position, stats in by_position.items():
+        durations = stats["durations"]
+        result.append(
+            {
+                "position": position,
+                "count": len(durations),
+                "failures": stats["failures"],
+                "timeouts": stats["timeouts"],
+                **{
+                    f"p{percentile}_ms": round(_percentile(durations, percentile), 1)
+                    for percentile in PERCENTILES
+                },
+                "max_ms": round(durations[-1], 1),
+            }
+        )
+    return result
+
+
+execution_log_writer = ExecutionLogWriter()
+
+gauge_func(
+    "cyd_execution_log_pending",
+    "Registros de execução aguardando gravação",
+    lambda: execution_log_writer.pending,
+)
+counter_func(
+    "cyd_execution_log_dropped_total",
+    "Registros de execução descartados com a fila cheia",
+    lambda: execution_log_writer.dropped,
+)
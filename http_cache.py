@@ -0,0 +1,110 @@
+"""
+Utilitários de cache HTTP (ETag / If-None-Match)
+
+Permite que os painéis revalidem recursos sem baixar o corpo novamente: se a
+ETag enviada em If-None-Match ainda é a atual, respondemos 304 sem corpo.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi.responses import Response
+from starlette.datastructures import Headers
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+# Os clientes devem sempre revalidar, mas podem reutilizar o corpo em cache
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Arquivos (ícones e renditions) com a ETag mantida em memória
+ETAG_CACHE_SIZE = 2048
+
+
+def make_etag(data: bytes) -> str:
+    """Gera uma ETag forte a partir do conteúdo"""
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Verifica se o cabeçalho If-None-Match corresponde à ETag atual"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified_response(etag: str, headers: Optional[Dict[str, str]] = None):
+    """Resposta 304 sem corpo, repetindo os validadores"""
+    response_headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if headers:
+        response_headers.update(headers)
+    return Response(status_code=304, headers=response_headers)
+
+
+class IconStaticFiles(StaticFiles):
+    """
+    StaticFiles com ETag forte baseada no hash do conteúdo do arquivo
+
+    O hash é calculado uma única vez por versão do arquivo (mtime + tamanho)
+    e mantido em memória, então revalidações custam apenas um stat(). O cache
+    tem uma entrada por caminho e é LRU, limitado a ETAG_CACHE_SIZE arquivos.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._etags: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self._etags_lock = threading.Lock()
+
+    def _content_etag(self, full_path: str, stat_result: os.stat_result) -> str:
+        with self._etags_lock:
+            cached = self._etags.get(full_path)
+            if (
+                cached
+                and cached[0] == stat_result.st_mtime_ns
+                and cached[1] == stat_result.st_size
+            ):
+                self._etags.move_to_end(full_path)
+                return cached[2]
+
+        digest = hashlib.sha256()
+        with open(full_path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        etag = '"' + digest.hexdigest()[:32] + '"'
+
+        with self._etags_lock:
+            self._etags[full_path] = (
+                stat_result.st_mtime_ns,
+                stat_result.st_size,
+                etag,
+            )
+            self._etags.move_to_end(full_path)
+            while len(self._etags) > ETAG_CACHE_SIZE:
+                self._etags.popitem(last=False)
+        return etag
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        etag = self._content_etag(str(full_path), stat_result)
+        request_headers = Headers(scope=scope)
+        if etag_matches(request_headers.get("if-none-match"), etag):
+            return not_modified_response(etag)
+
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["etag"] = etag
+        response.headers["cache-control"] = REVALIDATE_CACHE_CONTROL
+        return response
@@ -0,0 +1,144 @@
+"""
+Atlas dos ícones: todos os ícones dos botões em uma única requisição
+
+Em vez de baixar cada /uploads/<icone> separadamente, o painel busca uma folha
+de sprites com os ícones de todos os botões, já no tamanho da célula:
+
+    GET /api/buttons/atlas?api_key=...&fmt=rgb565|bmp8|indexed&w=...&h=...
+
+Formato da resposta (versão 1), todos os inteiros em little-endian:
+
+    Cabeçalho (14 bytes)
+        4 bytes  magic "CYDA"
+        u8       versão do formato (1)
+        u8       formato dos pixels (0 = RGB565 cru, 1 = arquivo BMP de 8 bits,
+                 2 = índices da paleta compartilhada, um byte por pixel)
+        u16      largura de cada sprite
+        u16      altura de cada sprite
+        u8       quantidade de sprites (N)
+        u8       reservado (0)
+        u16      reservado (0)
+
+    Tabela de offsets (N registros de 9 bytes)
+        u8       position do botão
+        u16      x do sprite na folha
+        u16      y do sprite na folha
+        u16      largura
+        u16      altura
+
+    Folha de sprites
+        RGB565: largura x (altura * N) pixels, linha a linha
+        BMP8: arquivo BMP completo, com uma paleta única para todos os sprites
+        indexed: largura x (altura * N) índices; a paleta vem de
+                 /api/buttons/palette (cabeçalho X-Palette-Id da resposta)
+
+Apenas botões cujo ícone é uma imagem em /uploads entram no atlas. O atlas é
+mantido em memória e só é gerado novamente quando algum ícone muda.
+"""
+import asyncio
+import struct
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from http_cache import make_etag
+from image_utils import image_conversion_service, render_icon_atlas
+from layout_cache import layout_icon_paths
+from shared_palette import SharedPalette, shared_palette_cache
+
+ATLAS_FORMAT_MAGIC = b"CYDA"
+ATLAS_FORMAT_VERSION = 1
+ATLAS_MEDIA_TYPE = "application/vnd.cyd.atlas"
+
+ATLAS_PIXEL_FORMATS = {"rgb565": 0, "bmp8": 1, "indexed": 2}
+
+# Quantidade de combinações formato/tamanho mantidas em memória
+ATLAS_CACHE_SIZE = 8
+
+
+@dataclass(frozen=True)
+class IconAtlas:
+    key: tuple
+    data: bytes
+    etag: str
+    palette_id: Optional[str] = None
+
+
+def _pack_atlas(
+    icons: Tuple[Tuple[int, str], ...], width: int, height: int, fmt: str, sheet: bytes
+) -> bytes:
+    parts = [
+        struct.pack(
+            "<4sBBHHBBH",
+            ATLAS_FORMAT_MAGIC,
+            ATLAS_FORMAT_VERSION,
+            ATLAS_PIXEL_FORMATS[fmt],
+            width,
+            height,
+            len(icons),
+            0,
+            0,
+        )
+    ]
+    for index, (position, _) in enumerate(icons):
+        parts.append(
+            struct.pack("<BHHHH", position & 0xFF, 0, index * height, width, height)
+        )
+    parts.append(sheet)
+    return b"".join(parts)
+
+
+class IconAtlasCache:
+    """Guarda o último atlas gerado para cada formato/tamanho (LRU)"""
+
+    def __init__(self, capacity: int = ATLAS_CACHE_SIZE):
+        self.capacity = capacity
+        self._atlases: "OrderedDict[tuple, IconAtlas]" = OrderedDict()
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+
+    async def get(self, width: int, height: int, fmt: str) -> IconAtlas:
+        """
+        Retorna o atlas dos ícones atuais, gerando-o se algum ícone mudou
+
+        Requisições simultâneas pelo mesmo atlas compartilham a geração.
+
+        Raises:
+            ConversionBusyError, ConversionTimeoutError: do pool de conversão
+        """
+        palette = await shared_palette_cache.get() if fmt == "indexed" else None
+        palette_id = palette.id if palette is not None else None
+        key = (layout_icon_paths(), width, height, fmt, palette_id)
+        atlas = self._atlases.get((width, height, fmt))
+        if atlas is not None and atlas.key == key:
+            self._atlases.move_to_end((width, height, fmt))
+            return atlas
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            in_flight = asyncio.ensure_future(self._build(key, palette))
+            self._in_flight[key] = in_flight
+            in_flight.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(in_flight)
+
+    async def _build(self, key: tuple, palette: Optional[SharedPalette]) -> IconAtlas:
+        icons, width, height, fmt, palette_id = key
+        sheet = await image_conversion_service.run(
+            render_icon_atlas,
+            [path for _, path in icons],
+            width,
+            height,
+            fmt,
+            palette.rgb888 if palette is not None else None,
+        )
+        data = _pack_atlas(icons, width, height, fmt, sheet)
+        atlas = IconAtlas(
+            key=key, data=data, etag=make_etag(data), palette_id=palette_id
+        )
+        self._atlases[(width, height, fmt)] = atlas
+        self._atlases.move_to_end((width, height, fmt))
+        while len(self._atlases) > self.capacity:
+            self._atlases.popitem(last=False)
+        return atlas
+
+
+icon_atlas_cache = IconAtlasCache()
@@ -0,0 +1,227 @@
+"""
+Formatos comprimidos para envio dos ícones ao painel
+
+Ícones de interface costumam ter grandes áreas de uma mesma cor, então o BMP
+de 8 bits sem compressão desperdiça banda e flash no ESP32. Dois formatos
+opcionais, ambos decodificáveis em streaming com pouca memória:
+
+rle8
+    BMP padrão com compressão BI_RLE8 (compression = 1 no cabeçalho), lido
+    por qualquer decodificador BMP completo. Cada linha é uma sequência de
+    pares (quantidade, índice), com trechos literais em modo absoluto.
+
+lz
+    Um LZSS simples, aplicado sobre o arquivo sem compressão (BMP de 8 bits
+    ou RGB565 cru). Todos os inteiros em little-endian:
+
+        4 bytes  magic "CYDZ"
+        u8       versão do formato (1)
+        u32      tamanho descomprimido
+
+    Seguido de blocos de um byte de flags e até 8 tokens, bit menos
+    significativo primeiro. Flag 1: um byte literal. Flag 0: uma referência
+    de 2 bytes, b0 | b1 << 8, com distância = (bits 0-11) + 1 (até 4096
+    bytes atrás) e tamanho = (bits 12-15) + 3 (3 a 18 bytes). O decodificador
+    precisa apenas de uma janela de 4 KB do que já foi escrito.
+"""
+import struct
+from typing import Dict, List
+
+from PIL import Image
+
+COMPRESSION_MODES = ("none", "rle8", "lz")
+
+LZ_MAGIC = b"CYDZ"
+LZ_VERSION = 1
+LZ_HEADER = struct.Struct("<4sBI")
+LZ_WINDOW = 4096
+LZ_MIN_MATCH = 3
+LZ_MAX_MATCH = 18
+# Candidatos examinados por posição (troca taxa de compressão por tempo)
+LZ_MAX_CANDIDATES = 32
+
+BMP_COMPRESSION_RLE8 = 1
+
+
+def _rle8_encode_row(row: bytes) -> bytearray:
+    """Codifica uma linha de índices em BI_RLE8 (sem o marcador de fim de linha)"""
+    out = bytearray()
+
+    def flush_literals(start: int, end: int):
+        while start < end:
+            count = min(255, end - start)
+            if count < 3:
+                # O modo absoluto exige ao menos 3 pixels
+                for value in row[start : start + count]:
+                    out.extend((1, value))
+            else:
+                out.extend((0, count))
+                out.extend(row[start : start + count])
+                if count & 1:
+                    out.append(0)  # Alinhamento em 16 bits
+            start += count
+
+    literal_start = 0
+    i = 0
+    size = len(row)
+    while i < size:
+        j = i + 1
+        while j < size and j - i < 255 and row[j] == row[i]:
+            j += 1
+        if j - i >= 3:
+            flush_literals(literal_start, i)
+            out.extend((j - i, row[i]))
+            literal_start = j
+        i = j
+    flush_literals(literal_start, size)
+    return out
+
+
+def encode_bmp_rle8(img: Image.Image) -> bytes:
+    """Gera um arquivo BMP de 8 bits com compressão BI_RLE8 (modo P ou L)"""
+    if img.mode == "L":
+        palette = [v for gray in range(256) for v in (gray, gray, gray)]
+    elif img.mode == "P":
+        palette = img.getpalette() or []
+    else:
+        raise ValueError(f"Modo de imagem não suportado para RLE8: {img.mode}")
+
+    width, height = img.size
+    pixels = img.tobytes()
+    data = bytearray()
+    # Linhas de baixo para cima, como no BMP sem compressão
+    for y in range(height - 1, -1, -1):
+        data += _rle8_encode_row(pixels[y * width : (y + 1) * width])
+        data += b"\x00\x00"  # Fim de linha
+    data += b"\x00\x01"  # Fim do bitmap
+
+    colors = len(palette) // 3
+    bmp_palette = b"".join(
+        bytes((palette[i + 2], palette[i + 1], palette[i], 0))
+        for i in range(0, colors * 3, 3)
+    )
+    offset = 14 + 40 + len(bmp_palette)
+    file_header = struct.pack("<2sIHHI", b"BM", offset + len(data), 0, 0, offset)
+    info_header = struct.pack(
+        "<IiiHHIIiiII",
+        40,
+        width,
+        height,
+        1,
+        8,
+        BMP_COMPRESSION_RLE8,
+        len(data),
+        2835,
+        2835,
+        colors,
+        0,
+    )
+    return file_header + info_header + bmp_palette + bytes(data)
+
+
+def lz_compress(data: bytes) -> bytes:
+    """Comprime no formato lz descrito no topo do módulo"""
+    out = bytearray(LZ_HEADER.pack(LZ_MAGIC, LZ_VERSION, len(data)))
+    size = len(data)
+    chains: Dict[bytes, List[int]] = {}
+    i = 0
+    while i < size:
+        flags_pos = len(out)
+        out.append(0)
+        flags = 0
+        for bit in range(8):
+            if i >= size:
+                break
+
+            best_length = 0
+            best_distance = 0
+            max_length = min(LZ_MAX_MATCH, size - i)
+            if max_length >= LZ_MIN_MATCH:
+                for candidate in reversed(chains.get(data[i : i + 3], ())):
+                    distance = i - candidate
+                    if distance > LZ_WINDOW:
+                        break
+                    length = LZ_MIN_MATCH
+                    while (
+                        length < max_length
+                        and data[candidate + length] == data[i + length]
+                    ):
+                        length += 1
+                    if length > best_length:
+                        best_length, best_distance = length, distance
+                        if length == max_length:
+                            break
+
+            if best_length >= LZ_MIN_MATCH:
+                token = (best_distance - 1) | ((best_length - LZ_MIN_MATCH) << 12)
+                out += struct.pack("<H", token)
+                advance = best_length
+            else:
+                flags |= 1 << bit
+                out.append(data[i])
+                advance = 1
+
+            for position in range(i, min(i + advance, size - 2)):
+                chain = chains.setdefault(data[position : position + 3], [])
+                chain.append(position)
+                if len(chain) > 2 * LZ_MAX_CANDIDATES:
+                    del chain[:LZ_MAX_CANDIDATES]
+            i += advance
+        out[flags_pos] = flags
+    return bytes(out)
+
+
+def lz_decompress(data: bytes) -> bytes:
+    """Decodificador de referência do formato lz (o mesmo algoritmo do firmware)"""
+    magic, version, size = LZ_HEADER.unpack_from(data)
+    if magic != LZ_MAGIC or version != LZ_VERSION:
+        raise ValueError("Dados não estão no formato lz")
+
+    out = bytearray()
+    i = LZ_HEADER.size
+    while len(out) < size:
+        flags = data[i]
+        i += 1
+        for bit in range(8):
+            if len(out) >= size:
+                break
+            if flags & (1 << bit):
+                out.append(data[i])
+                i += 1
+            else:
+                (token,) = struct.unpack_from("<H", data, i)
+                i += 2
+                start = len(out) - ((token & 0xFFF) + 1)
+                for k in range((token >> 12) + LZ_MIN_MATCH):
+                    out.append(out[start + k])
+    return bytes(out)
+
+
+def uncompressed_size(header: bytes, size: int) -> int:
+    """
+    Tamanho do ícone sem compressão, a partir dos primeiros bytes do arquivo
+
+    Args:
+        header: Início do arquivo (ao menos 54 bytes para BMP)
+        size: Tamanho do arquivo, retornado quando ele não está comprimido
+    """
+    if header[:4] == LZ_MAGIC and len(header) >= LZ_HEADER.size:
+        return LZ_HEADER.unpack_from(header)[2]
+    if header[:2] == b"BM" and len(header) >= 54:
+        (compression,) = struct.unpack_from("<I", header, 30)
+        if compression == BMP_COMPRESSION_RLE8:
+            (offset,) = struct.unpack_from("<I", header, 10)
+            width, height = struct.unpack_from("<ii", header, 18)
+            return offset + ((width + 3) & ~3) * abs(height)
+    return size
+
+
+def compression_report(data: bytes, compression: str) -> dict:
+    """Resumo do tamanho do ícone para as respostas da API"""
+    original = uncompressed_size(data[:64], len(data))
+    return {
+        "compression": compression,
+        "size": len(data),
+        "uncompressed_size": original,
+        "compression_ratio": round(original / len(data), 2) if data else 1.0,
+    }
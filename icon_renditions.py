@@ -0,0 +1,292 @@
+"""
+Renditions dos ícones no tamanho real da célula do botão
+
+Os ícones são enviados em qualquer resolução, mas o painel desenha cada botão
+em uma célula da tela de 320x240 cujo tamanho depende de `button_count`. Em vez
+de o ESP32 redimensionar a imagem, o servidor gera versões no tamanho exato:
+
+    GET /uploads/<icone>?fmt=bmp8|rgb565|indexed&w=<largura>&h=<altura>
+
+`w` e `h` são opcionais (padrão: tamanho da célula atual). `compression` pode
+ser `rle8` (apenas bmp8) ou `lz` (ver icon_compression). Com `fmt=indexed` a
+resposta traz só os índices da paleta compartilhada (ver shared_palette), um
+byte por pixel. As renditions ficam em cache no disco, em uploads/renditions/,
+com nome derivado do hash do conteúdo original + tamanho + formato. Mudar a
+resolução gera apenas as variantes que ainda não existem.
+
+Com `?compression=lz&original=1` a resposta é o próprio arquivo do ícone
+comprimido com LZ, sem redimensionar (a versão entregue pela conversão com
+`compression=lz`).
+"""
+import asyncio
+import os
+import stat
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+import anyio
+from starlette.datastructures import QueryParams
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.types import Scope
+
+from http_cache import IconStaticFiles
+from icon_compression import COMPRESSION_MODES, uncompressed_size
+from image_utils import (
+    RENDITION_FORMATS,
+    RENDITION_SOURCE_SUFFIXES,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    ConversionBusyError,
+    ConversionTimeoutError,
+    compress_icon_file,
+    image_conversion_service,
+    render_icon_rendition,
+)
+from layout_cache import current_cell_size
+from shared_palette import SharedPalette, shared_palette_cache
+
+RENDITION_MEDIA_TYPES = {
+    "bmp8": "image/bmp",
+    "rgb565": "application/octet-stream",
+    "indexed": "application/octet-stream",
+}
+
+# Formatos gerados em segundo plano ao enviar um ícone
+PREGENERATED_FORMATS = ("bmp8", "rgb565")
+# Renditions pré-geradas ao mesmo tempo; o restante da fila do pool de
+# conversão fica livre para as requisições dos usuários
+PREGENERATE_CONCURRENCY = 1
+
+# Pseudo-formato de `?original=1`: o arquivo do ícone, sem redimensionar
+ORIGINAL_FORMAT = "original"
+
+
+class IconFiles(IconStaticFiles):
+    """Serve /uploads com ETag de conteúdo e renditions sob demanda"""
+
+    def __init__(self, *args, renditions_dir: str = "renditions", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.renditions_dir = renditions_dir
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Criado no event loop, na primeira pré-geração
+        self._pregenerate_semaphore: Optional[asyncio.Semaphore] = None
+
+    def _renditions_path(self) -> Path:
+        path = Path(self.directory) / self.renditions_dir
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _rendition_path(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        width: int,
+        height: int,
+        fmt: str,
+        compression: str = "none",
+        palette: Optional[SharedPalette] = None,
+    ) -> Path:
+        source_hash = self._content_etag(full_path, stat_result).strip('"')
+        if fmt == ORIGINAL_FORMAT:
+            return self._renditions_path() / f"{source_hash}_original.{compression}"
+        filename = f"{source_hash}_{width}x{height}"
+        if palette is not None:
+            filename += f"_{palette.id}"
+        filename += f".{RENDITION_FORMATS[fmt]}"
+        if compression != "none":
+            filename += f".{compression}"
+        return self._renditions_path() / filename
+
+    async def ensure_rendition(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        width: int,
+        height: int,
+        fmt: str,
+        compression: str = "none",
+        palette: Optional[SharedPalette] = None,
+    ) -> Path:
+        """
+        Retorna o caminho da rendition, gerando-a se ainda não existir
+
+        Requisições simultâneas pela mesma rendition compartilham a geração.
+        O formato "indexed" exige a paleta compartilhada (`palette`), e
+        ORIGINAL_FORMAT apenas comprime o arquivo (`width`/`height` ignorados).
+
+        Raises:
+            ConversionBusyError, ConversionTimeoutError: do pool de conversão
+            RuntimeError: se a geração falhar
+        """
+        rendition_path = self._rendition_path(
+            full_path, stat_result, width, height, fmt, compression, palette
+        )
+        if rendition_path.exists():
+            return rendition_path
+
+        key = str(rendition_path)
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            if fmt == ORIGINAL_FORMAT:
+                job = image_conversion_service.run(compress_icon_file, full_path, key)
+            else:
+                job = image_conversion_service.run(
+                    render_icon_rendition,
+                    full_path,
+                    key,
+                    width,
+                    height,
+                    fmt,
+                    compression,
+                    palette.rgb888 if palette is not None else None,
+                )
+            in_flight = asyncio.ensure_future(job)
+            self._in_flight[key] = in_flight
+            in_flight.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        if not await asyncio.shield(in_flight):
+            raise RuntimeError("Falha ao gerar rendition do ícone")
+        return rendition_path
+
+    def _parse_rendition_params(self, scope: Scope) -> Optional[tuple]:
+        params = QueryParams(scope.get("query_string", b""))
+        if "original" in params:
+            if (
+                params.get("original") != "1"
+                or params.get("compression") != "lz"
+                or any(name in params for name in ("fmt", "w", "h"))
+            ):
+                raise HTTPException(
+                    status_code=400,
+                    detail="original=1 exige compression=lz, sem fmt, w ou h",
+                )
+            return 0, 0, ORIGINAL_FORMAT, "lz"
+        if not any(name in params for name in ("fmt", "w", "h", "compression")):
+            return None
+
+        fmt = params.get("fmt", "bmp8")
+        if fmt not in RENDITION_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Formato inválido. Use: {', '.join(RENDITION_FORMATS)}",
+            )
+
+        compression = params.get("compression", "none")
+        if compression not in COMPRESSION_MODES or (
+            compression == "rle8" and fmt != "bmp8"
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail="Compressão inválida. Use: none, rle8 (apenas bmp8) ou lz",
+            )
+
+        default_width, default_height = current_cell_size()
+        try:
+            width = int(params.get("w", default_width))
+            height = int(params.get("h", default_height))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="w e h devem ser inteiros")
+        if not (1 <= width <= SCREEN_WIDTH and 1 <= height <= SCREEN_HEIGHT):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Tamanho deve estar entre 1x1 e {SCREEN_WIDTH}x{SCREEN_HEIGHT}",
+            )
+        return width, height, fmt, compression
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        rendition = self._parse_rendition_params(scope)
+        if rendition is None:
+            return await super().get_response(path, scope)
+
+        width, height, fmt, compression = rendition
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        if (
+            not stat_result
+            or not stat.S_ISREG(stat_result.st_mode)
+            or Path(path).parts[0] == self.renditions_dir
+            or Path(path).suffix.lower() not in RENDITION_SOURCE_SUFFIXES
+        ):
+            raise HTTPException(status_code=404)
+
+        try:
+            palette = await shared_palette_cache.get() if fmt == "indexed" else None
+            rendition_path = await self.ensure_rendition(
+                full_path, stat_result, width, height, fmt, compression, palette
+            )
+        except ConversionBusyError:
+            raise HTTPException(
+                status_code=503,
+                detail="Muitas conversões em andamento, tente novamente em instantes",
+                headers={"Retry-After": "2"},
+            )
+        except ConversionTimeoutError:
+            raise HTTPException(
+                status_code=408, detail="Geração do ícone excedeu o tempo limite"
+            )
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        response = self.file_response(
+            rendition_path, os.stat(rendition_path), scope
+        )
+        response.headers["content-type"] = (
+            RENDITION_MEDIA_TYPES[fmt]
+            if compression != "lz"
+            else "application/octet-stream"
+        )
+        if fmt != ORIGINAL_FORMAT:
+            response.headers["x-image-width"] = str(width)
+            response.headers["x-image-height"] = str(height)
+        if palette is not None:
+            response.headers["x-palette-id"] = palette.id
+        if compression != "none":
+            response.headers["x-compression"] = compression
+            response.headers["x-uncompressed-length"] = str(
+                await anyio.to_thread.run_sync(
+                    self._uncompressed_length, rendition_path
+                )
+            )
+        return response
+
+    def _uncompressed_length(self, rendition_path: Path) -> int:
+        with open(rendition_path, "rb") as f:
+            header = f.read(64)
+        return uncompressed_size(header, os.path.getsize(rendition_path))
+
+    def pregenerate(self, icon: str):
+        """
+        Agenda em segundo plano a geração das renditions de um ícone no tamanho
+        atual da célula, para que o painel não espere na primeira requisição
+
+        As gerações de todos os ícones agendados passam por um semáforo
+        próprio e rodam uma de cada vez (PREGENERATE_CONCURRENCY).
+        """
+        if not icon or not icon.startswith("/uploads/"):
+            return
+        if Path(icon).suffix.lower() not in RENDITION_SOURCE_SUFFIXES:
+            return
+        if self._pregenerate_semaphore is None:
+            self._pregenerate_semaphore = asyncio.Semaphore(PREGENERATE_CONCURRENCY)
+        semaphore = self._pregenerate_semaphore
+
+        async def generate():
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, icon[len("/uploads/") :]
+            )
+            if not stat_result:
+                return
+            width, height = current_cell_size()
+            for fmt in PREGENERATED_FORMATS:
+                try:
+                    async with semaphore:
+                        await self.ensure_rendition(
+                            full_path, stat_result, width, height, fmt
+                        )
+                except Exception as e:
+                    print(f"Erro ao pré-gerar rendition do ícone: {e}")
+
+        task = asyncio.create_task(generate())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
@@ -1,8 +1,79 @@
+import asyncio
 import io
 import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Optional, Tuple
 
-from PIL import Image
+from PIL import Image, ImageChops, ImageOps
+
+from icon_compression import encode_bmp_rle8, lz_compress
+from metrics import counter, gauge_func, histogram
+
+# Processos dedicados à conversão de imagens (fora do event loop)
+IMAGE_CONVERSION_WORKERS = int(os.getenv("IMAGE_CONVERSION_WORKERS", "2"))
+# Máximo de conversões em andamento (executando + na fila)
+IMAGE_CONVERSION_QUEUE_LIMIT = int(os.getenv("IMAGE_CONVERSION_QUEUE_LIMIT", "8"))
+# Tempo limite de cada conversão, em segundos
+IMAGE_CONVERSION_TIMEOUT = float(os.getenv("IMAGE_CONVERSION_TIMEOUT", "20"))
+
+# Resolução da tela do Cheap Yellow Display (paisagem)
+SCREEN_WIDTH = 320
+SCREEN_HEIGHT = 240
+
+# Máximo de pixels decodificados por imagem (após a redução do JPEG); limita a
+# memória de cada conversão independentemente da resolução do arquivo enviado
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(4096 * 4096)))
+
+# Formatos de rendition suportados: nome -> extensão do arquivo em cache
+RENDITION_FORMATS = {"bmp8": "bmp", "rgb565": "rgb565", "indexed": "idx"}
+
+# Extensões que podem ser usadas como origem de uma rendition
+RENDITION_SOURCE_SUFFIXES = {".bmp", ".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+# Compressão do ícone guardado para cada modo pedido na conversão. O .lz não é
+# lido pelo PIL (renditions, atlas, paleta), então o ícone é guardado como BMP
+# e o LZ existe apenas como formato de entrega
+STORED_COMPRESSION = {"none": "none", "rle8": "rle8", "lz": "none"}
+
+
+class ImageTooLargeError(Exception):
+    """A imagem excede IMAGE_MAX_PIXELS"""
+
+
+def open_icon_image(
+    fp, max_size: tuple = (SCREEN_WIDTH, SCREEN_HEIGHT)
+) -> Image.Image:
+    """
+    Abre e decodifica uma imagem já reduzida para caber em `max_size`
+
+    JPEGs são decodificados direto em escala reduzida (1/2, 1/4 ou 1/8) com
+    Image.draft, então uma foto de 12 MP nunca é expandida por inteiro na
+    memória. Os demais formatos são reduzidos com reduce() + resample pelo
+    thumbnail(). A proporção é mantida e imagens menores não são ampliadas.
+
+    Raises:
+        ImageTooLargeError: se a imagem a decodificar exceder IMAGE_MAX_PIXELS
+    """
+    try:
+        img = Image.open(fp)
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError()
+
+    img.draft("RGB", max_size)
+    if img.width * img.height > IMAGE_MAX_PIXELS:
+        raise ImageTooLargeError()
+
+    if img.width > max_size[0] or img.height > max_size[1]:
+        if img.mode == "P":
+            # Redimensionar em modo paleta usaria apenas NEAREST
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        img.thumbnail(max_size)
+    return img
 
 
 def convert_to_8bit_bmp(input_path: str, output_path: str) -> bool:
@@ -17,8 +88,8 @@ def convert_to_8bit_bmp(input_path: str, output_path: str) -> bool:
         bool: True se a conversão foi bem sucedida, False caso contrário
     """
     try:
-        # Abre a imagem
-        with Image.open(input_path) as img:
+        # Abre a imagem (reduzida para caber na tela)
+        with open_icon_image(input_path) as img:
             # Converte para modo 8-bit (paleta de cores)
             if img.mode not in ("L", "P"):  # L = grayscale, P = palette
                 # Primeiro converte para RGB se necessário
@@ -36,20 +107,42 @@ def convert_to_8bit_bmp(input_path: str, output_path: str) -> bool:
         return False
 
 
-def convert_to_8bit_bmp_from_bytes(image_data: bytes, output_path: str) -> bool:
+def encode_bmp8(img: Image.Image, compression: str = "none") -> bytes:
     """
-    Converte dados de imagem diretamente para BMP de 8 bits
+    Salva uma imagem em modo P ou L como BMP de 8 bits
+
+    Args:
+        img: Imagem com paleta (P) ou em tons de cinza (L)
+        compression: "none", "rle8" (BMP BI_RLE8) ou "lz" (ver icon_compression)
+    """
+    if compression == "rle8":
+        return encode_bmp_rle8(img)
+    buffer = io.BytesIO()
+    img.save(buffer, "BMP")
+    if compression == "lz":
+        return lz_compress(buffer.getvalue())
+    return buffer.getvalue()
+
+
+def convert_to_8bit_bmp_bytes(
+    image_data: bytes, compression: str = "none"
+) -> Optional[bytes]:
+    """
+    Converte dados de imagem para BMP de 8 bits em memória
 
     Args:
         image_data: Dados binários da imagem
-        output_path: Caminho onde salvar a imagem BMP convertida
+        compression: "none", "rle8" ou "lz" (ver icon_compression)
 
     Returns:
-        bool: True se a conversão foi bem sucedida, False caso contrário
+        bytes: Conteúdo do BMP convertido, ou None se a conversão falhar
+
+    Raises:
+        ImageTooLargeError: se a imagem exceder IMAGE_MAX_PIXELS
     """
     try:
-        # Abre a imagem a partir dos dados binários
-        img = Image.open(io.BytesIO(image_data))
+        # Abre a imagem a partir dos dados binários (reduzida para caber na tela)
+        img = open_icon_image(io.BytesIO(image_data))
 
         # Converte para modo 8-bit (paleta de cores)
         if img.mode not in ("L", "P"):  # L = grayscale, P = palette
@@ -61,11 +154,52 @@ def convert_to_8bit_bmp_from_bytes(image_data: bytes, output_path: str) -> bool:
             img = img.convert("P", palette=Image.ADAPTIVE, colors=256)
 
         # Salva como BMP
-        img.save(output_path, "BMP")
-        return True
+        return encode_bmp8(img, compression)
+    except ImageTooLargeError:
+        raise
     except Exception as e:
         print(f"Erro ao converter imagem: {e}")
+        return None
+
+
+def convert_icon_bytes(
+    image_data: bytes, compression: str = "none"
+) -> Optional[Tuple[bytes, bytes]]:
+    """
+    Converte dados de imagem para o ícone guardado e para o formato pedido
+
+    Returns:
+        (BMP de 8 bits a guardar, arquivo em `compression`), ou None se a
+        conversão falhar. Só diferem com `lz` (ver STORED_COMPRESSION)
+
+    Raises:
+        ImageTooLargeError: se a imagem exceder IMAGE_MAX_PIXELS
+    """
+    stored = convert_to_8bit_bmp_bytes(image_data, STORED_COMPRESSION[compression])
+    if stored is None:
+        return None
+    if compression == "lz":
+        return stored, lz_compress(stored)
+    return stored, stored
+
+
+def convert_to_8bit_bmp_from_bytes(image_data: bytes, output_path: str) -> bool:
+    """
+    Converte dados de imagem diretamente para BMP de 8 bits
+
+    Args:
+        image_data: Dados binários da imagem
+        output_path: Caminho onde salvar a imagem BMP convertida
+
+    Returns:
+        bool: True se a conversão foi bem sucedida, False caso contrário
+    """
+    bmp_data = convert_to_8bit_bmp_bytes(image_data)
+    if bmp_data is None:
         return False
+    with open(output_path, "wb") as f:
+        f.write(bmp_data)
+    return True
 
 
 def convert_image_to_8bit_bmp(input_path: str, output_dir: str = None) -> str:
@@ -100,3 +234,355 @@ def convert_image_to_8bit_bmp(input_path: str, output_dir: str = None) -> str:
         return str(output_path)
     else:
         return None
+
+
+def button_cell_size(
+    button_count: int,
+    screen_width: int = SCREEN_WIDTH,
+    screen_height: int = SCREEN_HEIGHT,
+) -> tuple:
+    """
+    Calcula o tamanho (largura, altura) da célula de cada botão na tela
+
+    Escolhe a grade (colunas x linhas) que deixa os ícones maiores, ou seja,
+    que maximiza o menor lado da célula.
+    """
+    button_count = max(1, button_count)
+    best = None
+    for cols in range(1, button_count + 1):
+        rows = -(-button_count // cols)
+        cell = (screen_width // cols, screen_height // rows)
+        score = (min(cell), -(cols * rows - button_count))
+        if best is None or score > best[0]:
+            best = (score, cell)
+    return best[1]
+
+
+def _flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """Converte para RGB, compondo transparência sobre fundo preto"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (0, 0, 0))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def image_to_rgb565(img: Image.Image) -> bytes:
+    """Converte uma imagem para pixels RGB565 crus (little-endian, linha a linha)"""
+    r, g, b = _flatten_to_rgb(img).split()
+    high = ImageChops.add(r.point(lambda v: v & 0xF8), g.point(lambda v: v >> 5))
+    low = ImageChops.add(
+        g.point(lambda v: (v & 0x1C) << 3), b.point(lambda v: v >> 3)
+    )
+    # "LA" intercala os dois canais: byte baixo seguido do byte alto
+    return Image.merge("LA", (low, high)).tobytes()
+
+
+def _write_atomic(output_path: str, data: bytes):
+    """Grava em arquivo temporário e renomeia, evitando leituras parciais"""
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+
+
+def _render_icon_cell(source_path: str, width: int, height: int) -> Image.Image:
+    """Ícone em RGB, redimensionado e centralizado em fundo preto"""
+    with open_icon_image(source_path, (width, height)) as img:
+        rgb = _flatten_to_rgb(img)
+    return ImageOps.pad(rgb, (width, height), color=(0, 0, 0))
+
+
+def _render_icon_sheet(source_paths: list, width: int, height: int) -> Image.Image:
+    """Ícones empilhados verticalmente, um por faixa de `width` x `height`"""
+    sheet = Image.new("RGB", (width, height * len(source_paths)), (0, 0, 0))
+    for index, source_path in enumerate(source_paths):
+        try:
+            cell = _render_icon_cell(source_path, width, height)
+            sheet.paste(cell, (0, index * height))
+        except Exception as e:
+            print(f"Erro ao adicionar ícone à folha: {e}")
+    return sheet
+
+
+def quantize_to_palette(rgb: Image.Image, palette: bytes) -> Image.Image:
+    """Converte uma imagem RGB para índices de uma paleta fixa de 256 cores"""
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette)
+    return rgb.quantize(palette=palette_image, dither=Image.Dither.NONE)
+
+
+def build_shared_palette(source_paths: list, width: int, height: int) -> bytes:
+    """
+    Gera uma paleta única de 256 cores para um conjunto de ícones
+
+    Os ícones são renderizados no tamanho da célula (como nas renditions) e
+    quantizados juntos, então a paleta cobre as cores de todos eles.
+
+    Returns:
+        bytes: 256 cores RGB (768 bytes); entradas não usadas ficam pretas
+    """
+    if source_paths:
+        sheet = _render_icon_sheet(source_paths, width, height)
+    else:
+        sheet = Image.new("RGB", (1, 1), (0, 0, 0))
+    palette = bytes(sheet.quantize(256, method=Image.Quantize.MEDIANCUT).getpalette())
+    return palette[:768].ljust(768, b"\x00")
+
+
+def render_icon_rendition(
+    source_path: str,
+    output_path: str,
+    width: int,
+    height: int,
+    fmt: str,
+    compression: str = "none",
+    palette: Optional[bytes] = None,
+) -> bool:
+    """
+    Gera uma versão do ícone no tamanho exato da célula do botão
+
+    A imagem é redimensionada mantendo a proporção e centralizada em um
+    fundo preto de `width` x `height`.
+
+    Args:
+        source_path: Caminho da imagem original
+        output_path: Caminho onde salvar a rendition
+        width: Largura final em pixels
+        height: Altura final em pixels
+        fmt: "bmp8" (BMP de 8 bits), "rgb565" (pixels crus, little-endian) ou
+            "indexed" (um byte por pixel, índices de `palette`)
+        compression: "none", "rle8" (apenas bmp8) ou "lz"
+        palette: Paleta compartilhada (768 bytes RGB), obrigatória para "indexed"
+
+    Returns:
+        bool: True se a geração foi bem sucedida, False caso contrário
+    """
+    try:
+        rgb = _render_icon_cell(source_path, width, height)
+
+        if fmt == "rgb565":
+            data = image_to_rgb565(rgb)
+        elif fmt == "indexed":
+            data = quantize_to_palette(rgb, palette).tobytes()
+        else:
+            data = encode_bmp8(
+                rgb.convert("P", palette=Image.ADAPTIVE, colors=256), compression
+            )
+        if fmt != "bmp8" and compression == "lz":
+            data = lz_compress(data)
+
+        _write_atomic(output_path, data)
+        return True
+    except Exception as e:
+        print(f"Erro ao gerar rendition do ícone: {e}")
+        return False
+
+
+def compress_icon_file(source_path: str, output_path: str) -> bool:
+    """
+    Comprime com LZ o arquivo do ícone como está, sem redimensionar
+
+    Returns:
+        bool: True se a compressão foi bem sucedida, False caso contrário
+    """
+    try:
+        with open(source_path, "rb") as f:
+            data = f.read()
+        _write_atomic(output_path, lz_compress(data))
+        return True
+    except Exception as e:
+        print(f"Erro ao comprimir ícone: {e}")
+        return False
+
+
+def render_icon_atlas(
+    source_paths: list,
+    width: int,
+    height: int,
+    fmt: str,
+    palette: Optional[bytes] = None,
+) -> bytes:
+    """
+    Gera uma folha de sprites com vários ícones empilhados verticalmente
+
+    Cada ícone ocupa uma faixa de `width` x `height`, na ordem de
+    `source_paths`, e é redimensionado como em render_icon_rendition. Ícones
+    que não puderem ser abertos ficam pretos.
+
+    Returns:
+        bytes: pixels RGB565 crus (fmt "rgb565"), um arquivo BMP de 8 bits
+        com uma paleta única para todos os ícones (fmt "bmp8") ou índices de
+        `palette`, um byte por pixel (fmt "indexed")
+    """
+    if not source_paths:
+        return b""
+
+    sheet = _render_icon_sheet(source_paths, width, height)
+    if fmt == "rgb565":
+        return image_to_rgb565(sheet)
+    if fmt == "indexed":
+        return quantize_to_palette(sheet, palette).tobytes()
+    buffer = io.BytesIO()
+    sheet.convert("P", palette=Image.ADAPTIVE, colors=256).save(buffer, "BMP")
+    return buffer.getvalue()
+
+
+IMAGE_CONVERSION_SECONDS = histogram(
+    "cyd_image_conversion_duration_seconds",
+    "Duração das conversões de imagem no pool, incluindo a espera na fila",
+    ("function", "outcome"),
+)
+IMAGE_CONVERSION_REJECTED = counter(
+    "cyd_image_conversions_rejected_total",
+    "Conversões recusadas com a fila do pool cheia",
+)
+
+
+class ConversionBusyError(Exception):
+    """A fila de conversões está cheia"""
+
+
+class ConversionTimeoutError(Exception):
+    """A conversão excedeu o tempo limite"""
+
+
+class ConversionPoolBrokenError(ConversionBusyError):
+    """Um worker do pool morreu (ex.: OOM killer); o pool será recriado"""
+
+
+def _init_conversion_worker():
+    """
+    Restaura o tratamento padrão de sinais em um worker do pool
+
+    No Linux os workers são criados com fork e herdam os handlers do uvicorn,
+    inclusive o wakeup fd do event loop: um SIGTERM recebido pelo worker (o
+    pool envia aos workers restantes quando um deles morre) seria repassado
+    ao servidor, que encerraria. SIGINT fica com o processo principal.
+    """
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class ImageConversionService:
+    """
+    Executa conversões de imagem em um pool de processos limitado
+
+    A decodificação e a quantização com PIL podem levar centenas de
+    milissegundos; rodando em outro processo, não bloqueiam o event loop.
+    Quando há `max_pending` conversões em andamento, novas chamadas falham
+    imediatamente com ConversionBusyError (backpressure). Uma conversão que
+    estoura o tempo limite continua ocupando seu slot até o worker terminar,
+    então o limite reflete a carga real do pool.
+
+    Se um worker morrer, o ProcessPoolExecutor fica quebrado para sempre: as
+    conversões em andamento falham com ConversionPoolBrokenError e o pool é
+    descartado, sendo recriado na próxima chamada.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = IMAGE_CONVERSION_WORKERS,
+        max_pending: int = IMAGE_CONVERSION_QUEUE_LIMIT,
+        timeout: float = IMAGE_CONVERSION_TIMEOUT,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Conversões em andamento (executando + na fila)"""
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Criado sob demanda para não iniciar processos no import
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_conversion_worker
+            )
+        return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor):
+        """Descarta um pool quebrado (apenas se ainda for o atual)"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func, *args, timeout: float = None):
+        """
+        Executa `func(*args)` no pool de processos
+
+        Raises:
+            ConversionBusyError: se a fila estiver cheia
+            ConversionPoolBrokenError: se um worker do pool morreu
+            ConversionTimeoutError: se exceder o tempo limite
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                IMAGE_CONVERSION_REJECTED.inc()
+                raise ConversionBusyError()
+            self._pending += 1
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._discard_executor(executor)
+            raise ConversionPoolBrokenError()
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout or self.timeout
+            )
+            outcome = "ok"
+            return result
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise ConversionTimeoutError()
+        except BrokenProcessPool:
+            outcome = "broken"
+            self._discard_executor(executor)
+            raise ConversionPoolBrokenError()
+        finally:
+            IMAGE_CONVERSION_SECONDS.observe(
+                time.perf_counter() - start, func.__name__, outcome
+            )
+
+    async def convert_icon(
+        self, image_data: bytes, compression: str = "none"
+    ) -> Optional[Tuple[bytes, bytes]]:
+        """Versão assíncrona de convert_icon_bytes"""
+        return await self.run(convert_icon_bytes, image_data, compression)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_conversion_service = ImageConversionService()
+
+gauge_func(
+    "cyd_image_conversions_pending",
+    "Conversões de imagem em andamento (executando + na fila)",
+    lambda: image_conversion_service.pending,
+)
@@ -0,0 +1,277 @@
+"""
+Snapshot em memória do layout público dos botões
+
+O layout muda raramente (apenas quando o admin edita um botão), mas os painéis
+consultam /api/buttons/public o tempo todo. Em vez de consultar o SQLite e
+serializar com Pydantic a cada requisição, mantemos um snapshot imutável com o
+JSON (e o formato binário) já serializado, reconstruído sempre que um botão é
+alterado.
+
+Formato binário do layout (versão 1), todos os inteiros em little-endian:
+
+    Cabeçalho (10 bytes)
+        4 bytes  magic "CYDL"
+        u8       versão do formato (1)
+        u8       quantidade de botões
+        u32      versão do layout (a mesma enviada nos eventos de push)
+
+    Registro por botão
+        u16      tamanho do restante do registro, em bytes
+        u8       position
+        u16      background_color em RGB565
+        u8       tipo do ícone (0 = texto/emoji, 1 = caminho em /uploads)
+        u8       tamanho do label (N), seguido de N bytes UTF-8
+        u8       tamanho do ícone (M), seguido de M bytes UTF-8
+
+O prefixo de tamanho permite que versões futuras acrescentem campos ao fim do
+registro sem quebrar clientes antigos. Label e ícone são truncados em 255
+bytes, sem cortar caracteres UTF-8 no meio.
+"""
+import asyncio
+import json
+import struct
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import Button, SessionLocal, get_config_value
+from http_cache import make_etag
+from image_utils import RENDITION_SOURCE_SUFFIXES, button_cell_size
+
+BINARY_FORMAT_MAGIC = b"CYDL"
+BINARY_FORMAT_VERSION = 1
+BINARY_MEDIA_TYPE = "application/vnd.cyd.layout"
+
+ICON_KIND_TEXT = 0
+ICON_KIND_UPLOAD = 1
+
+DEFAULT_BACKGROUND_COLOR = "#3B82F6"
+
+UPLOAD_DIR = Path("uploads")
+
+
+@dataclass(frozen=True)
+class PublicButton:
+    position: int
+    label: str
+    icon: str
+    background_color: str
+
+
+@dataclass(frozen=True)
+class LayoutSnapshot:
+    version: int
+    buttons: Tuple[PublicButton, ...]
+    json_bytes: bytes
+    etag: str
+    bin_bytes: bytes
+    bin_etag: str
+
+
+class _LayoutChangeNotifier:
+    """
+    Notifica conexões em espera (WebSocket, SSE, long-poll) sobre mudanças
+
+    Todas as conexões aguardam o mesmo asyncio.Event, que é disparado e
+    substituído a cada nova versão. Assim uma conexão ociosa custa apenas uma
+    corrotina suspensa, sem fila ou buffer próprio.
+    """
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def notify(self):
+        event, self._event = self._event, asyncio.Event()
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if self._loop is None or running_loop is self._loop:
+            event.set()
+        else:
+            # Chamado fora do event loop (ex.: thread de startup ou worker)
+            self._loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Eventos ficam presos ao loop em que foram aguardados
+            self._loop = loop
+            self._event = asyncio.Event()
+        event = self._event
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def hex_to_rgb565(color: str) -> int:
+    """Converte uma cor #RRGGBB (ou #RGB) para RGB565"""
+    value = (color or "").strip().lstrip("#")
+    if len(value) == 3:
+        value = "".join(c * 2 for c in value)
+    try:
+        if len(value) != 6:
+            raise ValueError(color)
+        r, g, b = (int(value[i : i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return hex_to_rgb565(DEFAULT_BACKGROUND_COLOR)
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+def _encode_short_string(text: str) -> bytes:
+    """Codifica em UTF-8 com prefixo u8, truncando em 255 bytes"""
+    data = text.encode("utf-8")
+    if len(data) > 255:
+        data = data[:255].decode("utf-8", errors="ignore").encode("utf-8")
+    return struct.pack("<B", len(data)) + data
+
+
+def _serialize_binary(version: int, buttons: Tuple[PublicButton, ...]) -> bytes:
+    """Serializa o layout no formato binário documentado no topo do módulo"""
+    parts = [
+        struct.pack(
+            "<4sBBI",
+            BINARY_FORMAT_MAGIC,
+            BINARY_FORMAT_VERSION,
+            len(buttons),
+            version & 0xFFFFFFFF,
+        )
+    ]
+    for button in buttons:
+        icon_kind = (
+            ICON_KIND_UPLOAD if button.icon.startswith("/uploads/") else ICON_KIND_TEXT
+        )
+        body = (
+            struct.pack(
+                "<BHB",
+                button.position & 0xFF,
+                hex_to_rgb565(button.background_color),
+                icon_kind,
+            )
+            + _encode_short_string(button.label)
+            + _encode_short_string(button.icon)
+        )
+        parts.append(struct.pack("<H", len(body)) + body)
+    return b"".join(parts)
+
+
+_lock = threading.Lock()
+_version = 0
+_EMPTY_BINARY = _serialize_binary(0, ())
+_snapshot = LayoutSnapshot(
+    version=0,
+    buttons=(),
+    json_bytes=b"[]",
+    etag=make_etag(b"[]"),
+    bin_bytes=_EMPTY_BINARY,
+    bin_etag=make_etag(_EMPTY_BINARY),
+)
+_notifier = _LayoutChangeNotifier()
+
+
+def _serialize_json(buttons: Tuple[PublicButton, ...]) -> bytes:
+    """Serializa no mesmo formato de ButtonPublicResponse"""
+    payload = [
+        {"position": b.position, "label": b.label, "icon": b.icon} for b in buttons
+    ]
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+
+def _load_buttons(db: Session) -> Tuple[PublicButton, ...]:
+    rows = db.query(Button).order_by(Button.position).all()
+    return tuple(
+        PublicButton(
+            position=row.position,
+            label=row.label or "",
+            icon=row.icon or "",
+            background_color=row.background_color or "",
+        )
+        for row in rows
+    )
+
+
+def rebuild_layout_snapshot(db: Optional[Session] = None) -> LayoutSnapshot:
+    """
+    Reconstrói o snapshot a partir do banco e o publica atomicamente
+
+    Deve ser chamada depois do commit de qualquer alteração em botões. A
+    versão só avança (e os clientes conectados só são notificados) quando o
+    conteúdo do layout realmente muda.
+    """
+    global _version, _snapshot
+
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
+    try:
+        with _lock:
+            buttons = _load_buttons(db)
+            if _version and buttons == _snapshot.buttons:
+                return _snapshot
+            _version += 1
+            json_bytes = _serialize_json(buttons)
+            bin_bytes = _serialize_binary(_version, buttons)
+            snapshot = LayoutSnapshot(
+                version=_version,
+                buttons=buttons,
+                json_bytes=json_bytes,
+                etag=make_etag(json_bytes),
+                bin_bytes=bin_bytes,
+                bin_etag=make_etag(bin_bytes),
+            )
+            # Troca de referência é atômica: leitores veem o snapshot antigo
+            # ou o novo, nunca um estado intermediário
+            _snapshot = snapshot
+        _notifier.notify()
+        return snapshot
+    finally:
+        if owns_session:
+            db.close()
+
+
+def get_layout_snapshot() -> LayoutSnapshot:
+    """Retorna o snapshot atual do layout (sem acesso ao banco)"""
+    return _snapshot
+
+
+async def wait_for_layout_change(version: int, timeout: float) -> LayoutSnapshot:
+    """
+    Aguarda até que o layout saia da versão informada ou o timeout expire
+
+    Retorna o snapshot atual; se a versão for a mesma informada, o tempo
+    esgotou sem mudanças.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        snapshot = _snapshot
+        remaining = deadline - loop.time()
+        if snapshot.version != version or remaining <= 0:
+            return snapshot
+        await _notifier.wait(remaining)
+
+
+def current_cell_size() -> tuple:
+    """Tamanho da célula de cada botão para a configuração atual"""
+    return button_cell_size(int(get_config_value("button_count", "6")))
+
+
+def layout_icon_paths() -> Tuple[Tuple[int, str], ...]:
+    """(position, caminho) dos botões do layout atual cujo ícone é uma imagem"""
+    icons = []
+    for button in _snapshot.buttons:
+        if not button.icon.startswith("/uploads/"):
+            continue
+        path = UPLOAD_DIR / Path(button.icon).name
+        if path.suffix.lower() in RENDITION_SOURCE_SUFFIXES and path.is_file():
+            icons.append((button.position, str(path)))
+    return tuple(icons)
@@ -1,27 +1,58 @@
-import os
+import asyncio
+import io
+import json
 import secrets
-import shutil
-import subprocess
+import time
+import zipfile
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 
+import anyio
 from dotenv import load_dotenv
 from fastapi import (
     Depends,
     FastAPI,
     File,
     Form,
+    Header,
     HTTPException,
     Query,
+    Request,
     UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
     status,
 )
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
+from blob_store import run_garbage_collector, set_button_icon, store_blob
+from command_runner import (
+    CONCURRENCY_POLICIES,
+    DEFAULT_COMMAND_TIMEOUT,
+    DEFAULT_CONCURRENCY_POLICY,
+    DEFAULT_MAX_QUEUE,
+    MAX_COMMAND_TIMEOUT,
+    MAX_DEBOUNCE_MS,
+    MAX_QUEUE_LIMIT,
+    STREAM_QUEUE_SIZE,
+    ButtonCommand,
+    CommandTimeoutError,
+    ExecutionRejectedError,
+    JobStoreFullError,
+    button_scheduler,
+    job_store,
+    stream_execution,
+    wait_execution,
+)
 from command_validator import validate_command
 from database import (
     ApiKey,
@@ -36,39 +67,135 @@ from database import (
     is_setup_completed,
     set_config_value,
 )
-from image_utils import convert_to_8bit_bmp_from_bytes
+from execution_log import execution_log_writer, execution_stats
+from http_cache import (
+    REVALIDATE_CACHE_CONTROL,
+    etag_matches,
+    not_modified_response,
+)
+from icon_atlas import ATLAS_MEDIA_TYPE, ATLAS_PIXEL_FORMATS, icon_atlas_cache
+from icon_compression import COMPRESSION_MODES, compression_report
+from icon_renditions import IconFiles
+from image_utils import (
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    ConversionBusyError,
+    ConversionPoolBrokenError,
+    ConversionTimeoutError,
+    ImageTooLargeError,
+    image_conversion_service,
+)
+from layout_cache import (
+    BINARY_MEDIA_TYPE,
+    current_cell_size,
+    get_layout_snapshot,
+    rebuild_layout_snapshot,
+    wait_for_layout_change,
+)
+from metrics import METRICS_MEDIA_TYPE, MetricsMiddleware, registry
+from output_capture import (
+    DEFAULT_OUTPUT_LIMIT,
+    MAX_OUTPUT_LIMIT,
+    MIN_OUTPUT_LIMIT,
+    spill_path,
+)
+from page_cache import CachedPage
+from request_limits import (
+    MAX_BATCH_FILES,
+    MAX_BATCH_UPLOAD_BYTES,
+    MAX_UPLOAD_BYTES,
+    BodySizeLimitMiddleware,
+)
 from security import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
+    AuthenticatedUser,
     create_access_token,
     get_current_user,
     get_password_hash,
+    hash_api_key,
+    invalidate_token_cache,
+    load_api_key_cache,
+    mask_api_key,
+    verify_api_key,
     verify_password,
 )
+from shared_palette import PALETTE_FORMATS, shared_palette_cache
 
 load_dotenv()
 
 app = FastAPI(title="Stream Deck API", version="1.0.0")
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES,
+    path_limits={"/api/convert-to-bmp/batch": MAX_BATCH_UPLOAD_BYTES},
+)
 
 # Cria diretório para uploads
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# Serve arquivos estáticos (imagens)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Serve arquivos estáticos (imagens) com ETag baseada no conteúdo e
+# renditions no tamanho da célula do botão (?fmt=&w=&h=)
+icon_files = IconFiles(directory="uploads")
+app.mount("/uploads", icon_files, name="uploads")
 
 # Inicializa banco de dados
 init_db()
 
+# Carrega o snapshot do layout público e o índice de API keys
+rebuild_layout_snapshot()
+load_api_key_cache()
+
+# Tarefas de segundo plano iniciadas no startup
+background_tasks = set()
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """
+    Gera as renditions que faltam e inicia a coleta de lixo dos ícones e a
+    gravação do histórico de execuções
+    """
+    for button in get_layout_snapshot().buttons:
+        icon_files.pregenerate(button.icon)
+    background_tasks.add(asyncio.create_task(run_garbage_collector()))
+    background_tasks.add(asyncio.create_task(execution_log_writer.run()))
+
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    """Encerra as tarefas de segundo plano e o pool de conversão de imagens"""
+    for task in background_tasks:
+        task.cancel()
+    execution_log_writer.flush()
+    image_conversion_service.shutdown()
+
+
+# Páginas HTML mantidas em memória, já comprimidas
+INDEX_PAGE = CachedPage("templates/index.html")
+SETUP_PAGE = CachedPage("templates/setup.html")
+
 
 # Função para validar API Key
-def validate_api_key(api_key: str, db: Session) -> bool:
-    """Valida se a API key existe e está ativa"""
-    if not api_key:
-        return False
-    key_obj = (
-        db.query(ApiKey).filter(ApiKey.key == api_key, ApiKey.is_active == 1).first()
+def validate_api_key(api_key: str) -> bool:
+    """Valida se a API key existe e está ativa (índice em memória)"""
+    return verify_api_key(api_key) is not None
+
+
+# Janela padrão e máxima das estatísticas de execução
+DEFAULT_STATS_WINDOW_SECONDS = 24 * 3600
+MAX_STATS_WINDOW_SECONDS = 30 * 24 * 3600
+
+# Tempo máximo de espera de uma requisição long-poll / intervalo de keep-alive
+MAX_LONG_POLL_SECONDS = 60
+PUSH_KEEPALIVE_SECONDS = 15
+
+
+def layout_event_payload(snapshot) -> str:
+    """Evento de mudança de layout enviado via SSE e WebSocket"""
+    return json.dumps(
+        {"event": "layout", "version": snapshot.version, "etag": snapshot.etag}
     )
-    return key_obj is not None
 
 
 # Models
@@ -85,6 +212,11 @@ class ButtonUpdate(BaseModel):
     background_color: Optional[str] = None
     command: Optional[str] = None
     label: Optional[str] = None
+    timeout: Optional[int] = None
+    output_limit: Optional[int] = None
+    concurrency_policy: Optional[str] = None
+    debounce_ms: Optional[int] = None
+    max_queue: Optional[int] = None
 
 
 class ButtonResponse(BaseModel):
@@ -94,6 +226,11 @@ class ButtonResponse(BaseModel):
     background_color: str
     command: str
     label: str
+    timeout: int
+    output_limit: int
+    concurrency_policy: str
+    debounce_ms: int
+    max_queue: int
 
     class Config:
         from_attributes = True
@@ -160,10 +297,16 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
 @app.put("/api/account")
 async def update_account(
     update_data: UpdateCredentialsRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Atualiza username e/ou senha"""
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuário não encontrado"
+        )
+
     # if not verify_password(update_data.current_password, current_user.hashed_password):
     #     raise HTTPException(
     #         status_code=status.HTTP_401_UNAUTHORIZED, detail="Senha atual incorreta"
@@ -182,11 +325,11 @@ async def update_account(
             raise HTTPException(
                 status_code=400, detail="Username deve ter pelo menos 3 caracteres"
             )
-        if new_username != current_user.username:
+        if new_username != user.username:
             existing_user = db.query(User).filter(User.username == new_username).first()
             if existing_user:
                 raise HTTPException(status_code=400, detail="Username já existe")
-            current_user.username = new_username
+            user.username = new_username
             has_changes = True
 
     if new_password:
@@ -194,18 +337,20 @@ async def update_account(
             raise HTTPException(
                 status_code=400, detail="Senha deve ter pelo menos 6 caracteres"
             )
-        current_user.hashed_password = get_password_hash(new_password)
+        user.hashed_password = get_password_hash(new_password)
         has_changes = True
 
     if not has_changes:
         raise HTTPException(status_code=400, detail="Nenhuma alteração informada")
 
     db.commit()
-    db.refresh(current_user)
+    db.refresh(user)
+    # Tokens em cache referem-se às credenciais antigas
+    invalidate_token_cache()
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": current_user.username}, expires_delta=access_token_expires
+        data={"sub": user.username}, expires_delta=access_token_expires
     )
 
     return {"message": "Credenciais atualizadas", "access_token": access_token}
@@ -213,7 +358,7 @@ async def update_account(
 
 @app.get("/api/buttons", response_model=List[ButtonResponse])
 async def get_buttons(
-    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_user), db: Session = Depends(get_db)
 ):
     """Retorna todos os botões (requer autenticação)"""
     buttons = db.query(Button).order_by(Button.position).all()
@@ -223,7 +368,17 @@ async def get_buttons(
 @app.get("/api/buttons/public", response_model=List[ButtonPublicResponse])
 async def get_buttons_public(
     api_key: str = Query(..., description="API Key para autenticação"),
-    db: Session = Depends(get_db),
+    wait: int = Query(
+        0,
+        ge=0,
+        le=MAX_LONG_POLL_SECONDS,
+        description="Long-poll: segundos para aguardar uma mudança no layout",
+    ),
+    format: Optional[str] = Query(
+        None, description="`bin` para o formato binário compacto"
+    ),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
     Retorna todos os botões via API Key (público)
@@ -233,22 +388,271 @@ async def get_buttons_public(
     ```
     GET http://localhost:62641/api/buttons/public?api_key=SUA_API_KEY
     ```
+
+    A resposta inclui uma ETag. Enviando-a de volta em `If-None-Match`,
+    o servidor responde `304 Not Modified` sem corpo enquanto o layout
+    não mudar.
+
+    Com `?wait=N` (long-poll), se a ETag enviada ainda for a atual, a
+    requisição fica aberta por até N segundos e retorna assim que o layout
+    mudar (ou 304 se nada mudar nesse intervalo).
+
+    Com `?format=bin` (ou `Accept: application/vnd.cyd.layout`) retorna o
+    layout no formato binário descrito em `layout_cache.py`, que inclui
+    também a cor de fundo em RGB565.
     """
     # Valida API key
-    if not validate_api_key(api_key, db):
+    if not validate_api_key(api_key):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API Key inválida ou inativa",
         )
 
-    buttons = db.query(Button).order_by(Button.position).all()
-    return buttons
+    binary = format == "bin" or (accept is not None and BINARY_MEDIA_TYPE in accept)
+
+    def current_etag(snapshot):
+        return snapshot.bin_etag if binary else snapshot.etag
+
+    # Serve o snapshot em memória, já serializado
+    snapshot = get_layout_snapshot()
+    if wait and etag_matches(if_none_match, current_etag(snapshot)):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while etag_matches(if_none_match, current_etag(snapshot)):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            snapshot = await wait_for_layout_change(snapshot.version, remaining)
+
+    etag = current_etag(snapshot)
+    headers = {"Vary": "Accept"}
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag, headers)
+
+    headers.update({"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+    if binary:
+        return Response(
+            content=snapshot.bin_bytes, media_type=BINARY_MEDIA_TYPE, headers=headers
+        )
+    return Response(
+        content=snapshot.json_bytes, media_type="application/json", headers=headers
+    )
+
+
+@app.get("/api/buttons/atlas")
+async def get_buttons_atlas(
+    api_key: str = Query(..., description="API Key para autenticação"),
+    fmt: str = Query("rgb565", description="`rgb565`, `bmp8` ou `indexed`"),
+    w: Optional[int] = Query(None, ge=1, le=SCREEN_WIDTH, description="Largura"),
+    h: Optional[int] = Query(None, ge=1, le=SCREEN_HEIGHT, description="Altura"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Retorna os ícones de todos os botões em uma única folha de sprites
+
+    O formato (cabeçalho `CYDA`, tabela de offsets e pixels) está descrito
+    em `icon_atlas.py`. Sem `w`/`h`, usa o tamanho da célula calculado a
+    partir de `button_count`. O atlas só é gerado de novo quando algum
+    ícone muda; com `If-None-Match` o servidor responde `304`.
+    """
+    # Valida API key
+    if not validate_api_key(api_key):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API Key inválida ou inativa",
+        )
+
+    if fmt not in ATLAS_PIXEL_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato inválido. Use: {', '.join(ATLAS_PIXEL_FORMATS)}",
+        )
+
+    default_width, default_height = current_cell_size()
+    try:
+        atlas = await icon_atlas_cache.get(w or default_width, h or default_height, fmt)
+    except ConversionBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Muitas conversões em andamento, tente novamente em instantes",
+            headers={"Retry-After": "2"},
+        )
+    except ConversionTimeoutError:
+        raise HTTPException(
+            status_code=408, detail="Geração do atlas excedeu o tempo limite"
+        )
+
+    headers = {"X-Palette-Id": atlas.palette_id} if atlas.palette_id else {}
+    if etag_matches(if_none_match, atlas.etag):
+        return not_modified_response(atlas.etag, headers)
+    headers.update({"ETag": atlas.etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+    return Response(content=atlas.data, media_type=ATLAS_MEDIA_TYPE, headers=headers)
+
+
+@app.get("/api/buttons/palette")
+async def get_buttons_palette(
+    api_key: str = Query(..., description="API Key para autenticação"),
+    fmt: str = Query("rgb888", description="`rgb888` ou `rgb565`"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Retorna a paleta de 256 cores compartilhada por todos os ícones
+
+    `rgb888`: 768 bytes (R, G, B por cor); `rgb565`: 512 bytes (u16
+    little-endian por cor). Os ícones em `fmt=indexed` trazem apenas índices
+    desta paleta. Ela é gerada de novo quando algum ícone muda; o cabeçalho
+    `X-Palette-Id` permite ao painel saber quando recarregá-la.
+    """
+    # Valida API key
+    if not validate_api_key(api_key):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API Key inválida ou inativa",
+        )
+
+    if fmt not in PALETTE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato inválido. Use: {', '.join(PALETTE_FORMATS)}",
+        )
+
+    try:
+        palette = await shared_palette_cache.get()
+    except ConversionBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Muitas conversões em andamento, tente novamente em instantes",
+            headers={"Retry-After": "2"},
+        )
+    except ConversionTimeoutError:
+        raise HTTPException(
+            status_code=408, detail="Geração da paleta excedeu o tempo limite"
+        )
+
+    etag = palette.etag(fmt)
+    headers = {"X-Palette-Id": palette.id}
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag, headers)
+    headers.update({"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+    return Response(
+        content=palette.data(fmt),
+        media_type="application/octet-stream",
+        headers=headers,
+    )
+
+
+@app.get("/api/events")
+async def layout_events(
+    api_key: str = Query(..., description="API Key para autenticação"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Stream Server-Sent Events com as mudanças de layout (público)
+
+    Envia um evento `layout` com `version` e `etag` ao conectar e a cada
+    alteração de botão. Ao receber o evento, o painel busca
+    /api/buttons/public com `If-None-Match`. O id do evento é o ETag do
+    layout (a versão recomeça a cada reinício do servidor), então uma
+    reconexão com `Last-Event-ID` só pula o evento inicial se o layout for o
+    mesmo.
+
+    Uso:
+    ```
+    GET http://localhost:62641/api/events?api_key=SUA_API_KEY
+    ```
+    """
+    if not validate_api_key(api_key):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API Key inválida ou inativa",
+        )
+
+    async def event_stream():
+        snapshot = get_layout_snapshot()
+        if last_event_id != snapshot.etag:
+            yield (
+                f"event: layout\nid: {snapshot.etag}\n"
+                f"data: {layout_event_payload(snapshot)}\n\n"
+            )
+        version = snapshot.version
+        while True:
+            snapshot = await wait_for_layout_change(version, PUSH_KEEPALIVE_SECONDS)
+            # Encerra o stream assim que a API key for desativada
+            if not validate_api_key(api_key):
+                return
+            if snapshot.version == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = snapshot.version
+            yield (
+                f"event: layout\nid: {snapshot.etag}\n"
+                f"data: {layout_event_payload(snapshot)}\n\n"
+            )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/api/ws")
+async def layout_websocket(websocket: WebSocket, api_key: str = ""):
+    """
+    WebSocket com as mudanças de layout (público)
+
+    Envia o mesmo payload JSON do SSE ao conectar e a cada alteração.
+
+    Uso:
+    ```
+    ws://localhost:62641/api/ws?api_key=SUA_API_KEY
+    ```
+    """
+    if not validate_api_key(api_key):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    # Detecta desconexão sem precisar processar mensagens do cliente
+    receiver = asyncio.create_task(websocket.receive())
+    try:
+        snapshot = get_layout_snapshot()
+        await websocket.send_text(layout_event_payload(snapshot))
+        version = snapshot.version
+        while True:
+            waiter = asyncio.create_task(
+                wait_for_layout_change(version, PUSH_KEEPALIVE_SECONDS)
+            )
+            done, _ = await asyncio.wait(
+                {receiver, waiter}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if receiver in done:
+                waiter.cancel()
+                if receiver.result()["type"] == "websocket.disconnect":
+                    break
+                # Mensagens do cliente (ex.: ping) são ignoradas
+                receiver = asyncio.create_task(websocket.receive())
+                continue
+
+            # Encerra a conexão assim que a API key for desativada
+            if not validate_api_key(api_key):
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                break
+
+            snapshot = waiter.result()
+            if snapshot.version != version:
+                version = snapshot.version
+                await websocket.send_text(layout_event_payload(snapshot))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
 
 
 @app.get("/api/buttons/{position}", response_model=ButtonResponse)
 async def get_button(
     position: int,
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Retorna um botão específico por posição"""
@@ -262,7 +666,7 @@ async def get_button(
 async def upload_icon(
     position: int,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Upload de imagem para o ícone de um botão"""
@@ -274,40 +678,97 @@ async def upload_icon(
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Arquivo deve ser uma imagem")
 
-    # Gera nome único para o arquivo
+    # Salva arquivo (deduplicado pelo hash do conteúdo)
     file_extension = Path(file.filename).suffix if file.filename else ".png"
-    filename = f"button_{position}_{int(os.urandom(4).hex(), 16)}{file_extension}"
-    file_path = UPLOAD_DIR / filename
-
-    # Salva arquivo
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Remove imagem antiga se existir e não for emoji
-    if button.icon and button.icon.startswith("/uploads/"):
-        old_file_path = UPLOAD_DIR / Path(button.icon).name
-        if old_file_path.exists():
-            try:
-                os.remove(old_file_path)
-            except:
-                pass
+    icon_url = store_blob(db, await file.read(), file_extension)
 
-    # Atualiza botão com caminho da imagem
-    button.icon = f"/uploads/{filename}"
+    # Atualiza botão com caminho da imagem (e as referências dos arquivos)
+    set_button_icon(db, button, icon_url)
     db.commit()
     db.refresh(button)
+    rebuild_layout_snapshot(db)
+    icon_files.pregenerate(button.icon)
 
     return {"icon": button.icon}
 
 
+# Extensão do arquivo entregue (zip do lote) para cada modo de compressão; o
+# ícone guardado é sempre um .bmp (ver STORED_COMPRESSION)
+COMPRESSION_SUFFIXES = {"none": ".bmp", "rle8": ".bmp", "lz": ".lz"}
+
+
+def validate_compression(compression: str):
+    if compression not in COMPRESSION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Compressão inválida. Use: {', '.join(COMPRESSION_MODES)}",
+        )
+
+
+async def convert_image_to_bmp(
+    image_data: bytes, compression: str = "none"
+) -> Tuple[bytes, bytes]:
+    """
+    Converte a imagem fora do event loop, traduzindo falhas em HTTPException
+
+    Returns:
+        (BMP a guardar, arquivo no formato `compression`)
+    """
+    try:
+        converted = await image_conversion_service.convert_icon(
+            image_data, compression
+        )
+    except ConversionPoolBrokenError:
+        raise HTTPException(
+            status_code=503,
+            detail="Conversor de imagens reiniciado, tente novamente",
+            headers={"Retry-After": "1"},
+        )
+    except ConversionBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Muitas conversões em andamento, tente novamente em instantes",
+            headers={"Retry-After": "2"},
+        )
+    except ConversionTimeoutError:
+        raise HTTPException(
+            status_code=408, detail="Conversão da imagem excedeu o tempo limite"
+        )
+    except ImageTooLargeError:
+        raise HTTPException(
+            status_code=413, detail="Resolução da imagem excede o limite permitido"
+        )
+
+    if converted is None:
+        raise HTTPException(
+            status_code=500, detail="Falha ao converter imagem para BMP de 8 bits"
+        )
+    return converted
+
+
+def lz_variant(url: str, compression: str) -> dict:
+    """URL da versão LZ de um ícone guardado (o BMP comprimido, sem redimensionar)"""
+    return {"lz_url": f"{url}?compression=lz&original=1"} if compression == "lz" else {}
+
+
 @app.post("/api/buttons/{position}/convert-to-bmp")
 async def convert_to_bmp(
     position: int,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
+    compression: str = Query("none", description="`none`, `rle8` ou `lz`"),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    """Converte uma imagem JPG ou PNG para BMP de 8 bits e faz upload como ícone de botão"""
+    """
+    Converte uma imagem JPG ou PNG para BMP de 8 bits e faz upload como ícone de botão
+
+    Com `?compression=rle8` o BMP usa compressão BI_RLE8. Com
+    `?compression=lz` o ícone continua guardado como BMP (é a origem das
+    renditions, do atlas e da paleta); a versão LZ, no formato descrito em
+    `icon_compression.py`, é servida em `lz_url` exatamente como descrita pelo
+    relatório de tamanho (o BMP guardado comprimido, sem redimensionar).
+    """
+    validate_compression(compression)
     button = db.query(Button).filter(Button.position == position).first()
     if not button:
         raise HTTPException(status_code=404, detail="Botão não encontrado")
@@ -327,40 +788,40 @@ async def convert_to_bmp(
     # Lê os dados da imagem
     image_data = await file.read()
 
-    # Gera nome único para o arquivo BMP
-    bmp_filename = f"button_{position}_{int(os.urandom(4).hex(), 16)}_8bit.bmp"
-    bmp_file_path = UPLOAD_DIR / bmp_filename
-
-    # Converte a imagem para BMP de 8 bits
-    success = convert_to_8bit_bmp_from_bytes(image_data, str(bmp_file_path))
-
-    if not success:
-        raise HTTPException(
-            status_code=500, detail="Falha ao converter imagem para BMP de 8 bits"
-        )
-
-    # Remove imagem antiga se existir e não for emoji
-    if button.icon and button.icon.startswith("/uploads/"):
-        old_file_path = UPLOAD_DIR / Path(button.icon).name
-        if old_file_path.exists():
-            try:
-                os.remove(old_file_path)
-            except:
-                pass
+    # Converte a imagem para BMP de 8 bits (no pool de processos)
+    bmp_data, delivered = await convert_image_to_bmp(image_data, compression)
+    icon_url = store_blob(db, bmp_data, ".bmp")
 
-    # Atualiza botão com caminho da imagem BMP
-    button.icon = f"/uploads/{bmp_filename}"
+    # Atualiza botão com caminho da imagem BMP (e as referências dos arquivos)
+    set_button_icon(db, button, icon_url)
     db.commit()
     db.refresh(button)
+    rebuild_layout_snapshot(db)
+    icon_files.pregenerate(button.icon)
 
-    return {"icon": button.icon}
+    return {
+        "icon": button.icon,
+        **lz_variant(button.icon, compression),
+        **compression_report(delivered, compression),
+    }
 
 
 @app.post("/api/convert-to-bmp")
 async def general_convert_to_bmp(
-    file: UploadFile = File(...), current_user: User = Depends(get_current_user)
+    file: UploadFile = File(...),
+    compression: str = Query("none", description="`none`, `rle8` ou `lz`"),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
 ):
-    """Converte uma imagem JPG ou PNG para BMP de 8 bits"""
+    """
+    Converte uma imagem JPG ou PNG para BMP de 8 bits
+
+    O arquivo convertido fica disponível por BLOB_GC_GRACE_SECONDS, ou
+    enquanto estiver em uso como ícone de algum botão. O parâmetro
+    `compression` funciona como em /api/buttons/{position}/convert-to-bmp.
+    """
+    validate_compression(compression)
+
     # Valida tipo de arquivo
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Arquivo deve ser uma imagem")
@@ -376,26 +837,165 @@ async def general_convert_to_bmp(
     # Lê os dados da imagem
     image_data = await file.read()
 
-    # Gera nome único para o arquivo BMP
-    bmp_filename = f"converted_{int(os.urandom(4).hex(), 16)}_8bit.bmp"
-    bmp_file_path = UPLOAD_DIR / bmp_filename
+    # Converte a imagem para BMP de 8 bits (no pool de processos)
+    bmp_data, delivered = await convert_image_to_bmp(image_data, compression)
+    bmp_url = store_blob(db, bmp_data, ".bmp")
+    db.commit()
+
+    return {
+        "bmp_path": bmp_url,
+        **lz_variant(bmp_url, compression),
+        **compression_report(delivered, compression),
+    }
+
+
+def conversion_file_error(file: UploadFile) -> Optional[str]:
+    """Mesma validação dos endpoints de conversão, retornando o erro (ou None)"""
+    if not file.content_type or not file.content_type.startswith("image/"):
+        return "Arquivo deve ser uma imagem"
+    if Path(file.filename or "").suffix.lower() not in [".jpg", ".jpeg", ".png"]:
+        return "Apenas arquivos JPG, JPEG ou PNG são suportados para conversão"
+    # O corpo do lote tem limite próprio; cada arquivo segue o de um upload
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        return f"Arquivo excede o tamanho máximo de {MAX_UPLOAD_BYTES // 1024} KB"
+    return None
+
+
+@app.post("/api/convert-to-bmp/batch")
+async def batch_convert_to_bmp(
+    files: List[UploadFile] = File(...),
+    positions: List[int] = Form([]),
+    compression: str = Query("none", description="`none`, `rle8` ou `lz`"),
+    response_format: str = Query("json", description="`json` ou `zip`"),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Converte várias imagens JPG ou PNG para BMP de 8 bits de uma vez
 
-    # Converte a imagem para BMP de 8 bits
-    success = convert_to_8bit_bmp_from_bytes(image_data, str(bmp_file_path))
+    As conversões rodam em paralelo no pool de processos. Se `positions` for
+    informado (um por arquivo, na mesma ordem), cada BMP vira o ícone do
+    botão correspondente, tudo em uma única transação. Um arquivo que falhar
+    não impede os demais: o resultado de cada um vem na resposta.
 
-    if not success:
+    Com `?response_format=zip` a resposta é um arquivo zip com os arquivos
+    convertidos (no formato de `compression`) e um `results.json` com o
+    resultado de cada arquivo.
+    """
+    validate_compression(compression)
+    if response_format not in ("json", "zip"):
         raise HTTPException(
-            status_code=500, detail="Falha ao converter imagem para BMP de 8 bits"
+            status_code=400, detail="response_format inválido. Use: json, zip"
         )
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo de {MAX_BATCH_FILES} arquivos por requisição",
+        )
+    if positions and len(positions) != len(files):
+        raise HTTPException(
+            status_code=400,
+            detail="Informe uma posição para cada arquivo",
+        )
+    if positions and len(set(positions)) != len(positions):
+        raise HTTPException(status_code=400, detail="Posições repetidas")
+
+    buttons = {}
+    if positions:
+        buttons = {
+            button.position: button
+            for button in db.query(Button).filter(Button.position.in_(positions))
+        }
+        missing = sorted(set(positions) - set(buttons))
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Botões não encontrados: {', '.join(map(str, missing))}",
+            )
+
+    # Limita a quantidade de conversões simultâneas deste lote ao número de
+    # processos, para não esgotar a fila compartilhada com outras requisições
+    semaphore = asyncio.Semaphore(image_conversion_service.max_workers)
+
+    async def convert(file: UploadFile) -> bytes:
+        error = conversion_file_error(file)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+        # Lê o arquivo só dentro do semáforo, para que no máximo
+        # `max_workers` uploads do lote fiquem em memória ao mesmo tempo
+        async with semaphore:
+            image_data = await file.read()
+            return await convert_image_to_bmp(image_data, compression)
+
+    converted = await asyncio.gather(
+        *(convert(file) for file in files), return_exceptions=True
+    )
+    # Pool quebrado ou sem vaga: o lote inteiro pode ser repetido, então
+    # responde 503 antes de gravar qualquer ícone
+    for result in converted:
+        if isinstance(result, HTTPException) and result.status_code == 503:
+            raise result
+
+    results = []
+    archive_files = []
+    for index, (file, conversion) in enumerate(zip(files, converted)):
+        result = {"filename": file.filename, "success": False}
+        if positions:
+            result["position"] = positions[index]
+
+        if isinstance(conversion, HTTPException):
+            result["error"] = conversion.detail
+        elif isinstance(conversion, BaseException):
+            result["error"] = f"Erro ao converter imagem: {str(conversion)}"
+        else:
+            bmp_data, delivered = conversion
+            bmp_url = store_blob(db, bmp_data, ".bmp")
+            if positions:
+                set_button_icon(db, buttons[positions[index]], bmp_url)
+            result.update(
+                {
+                    "success": True,
+                    "bmp_path": bmp_url,
+                    **lz_variant(bmp_url, compression),
+                    **compression_report(delivered, compression),
+                }
+            )
+            archive_files.append((index, file.filename, delivered))
+        results.append(result)
 
-    return {"bmp_path": f"/uploads/{bmp_filename}"}
+    # Todas as atribuições em uma única transação
+    db.commit()
+    if positions:
+        rebuild_layout_snapshot(db)
+        for result in results:
+            if result["success"]:
+                icon_files.pregenerate(result["bmp_path"])
+
+    if response_format == "json":
+        return {"results": results}
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for index, filename, data in archive_files:
+            stem = Path(filename or "").stem or "imagem"
+            arcname = f"{index:02d}_{stem}{COMPRESSION_SUFFIXES[compression]}"
+            results[index]["archive_name"] = arcname
+            archive.writestr(arcname, data)
+        archive.writestr(
+            "results.json", json.dumps(results, ensure_ascii=False, indent=2)
+        )
+    return Response(
+        content=buffer.getvalue(),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="convertidos.zip"'},
+    )
 
 
 @app.put("/api/buttons/{position}", response_model=ButtonResponse)
 async def update_button(
     position: int,
     button_update: ButtonUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Atualiza um botão"""
@@ -409,23 +1009,79 @@ async def update_button(
         if not is_valid:
             raise HTTPException(status_code=400, detail=error_msg)
 
+    # Valida timeout se fornecido
+    if button_update.timeout is not None and not (
+        1 <= button_update.timeout <= MAX_COMMAND_TIMEOUT
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Timeout deve estar entre 1 e {MAX_COMMAND_TIMEOUT} segundos",
+        )
+
+    # Valida limite de saída se fornecido
+    if button_update.output_limit is not None and not (
+        MIN_OUTPUT_LIMIT <= button_update.output_limit <= MAX_OUTPUT_LIMIT
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Limite de saída deve estar entre {MIN_OUTPUT_LIMIT} e "
+                f"{MAX_OUTPUT_LIMIT} bytes"
+            ),
+        )
+
+    # Valida política de concorrência se fornecida
+    if (
+        button_update.concurrency_policy is not None
+        and button_update.concurrency_policy not in CONCURRENCY_POLICIES
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Política deve ser uma de: {', '.join(CONCURRENCY_POLICIES)}",
+        )
+    if button_update.debounce_ms is not None and not (
+        0 <= button_update.debounce_ms <= MAX_DEBOUNCE_MS
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Debounce deve estar entre 0 e {MAX_DEBOUNCE_MS} ms",
+        )
+    if button_update.max_queue is not None and not (
+        1 <= button_update.max_queue <= MAX_QUEUE_LIMIT
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tamanho da fila deve estar entre 1 e {MAX_QUEUE_LIMIT}",
+        )
+
     # Atualiza campos
     if button_update.icon is not None:
-        button.icon = button_update.icon
+        set_button_icon(db, button, button_update.icon)
     if button_update.background_color is not None:
         button.background_color = button_update.background_color
     if button_update.command is not None:
         button.command = button_update.command
     if button_update.label is not None:
         button.label = button_update.label
+    if button_update.timeout is not None:
+        button.timeout = button_update.timeout
+    if button_update.output_limit is not None:
+        button.output_limit = button_update.output_limit
+    if button_update.concurrency_policy is not None:
+        button.concurrency_policy = button_update.concurrency_policy
+    if button_update.debounce_ms is not None:
+        button.debounce_ms = button_update.debounce_ms
+    if button_update.max_queue is not None:
+        button.max_queue = button_update.max_queue
 
     db.commit()
     db.refresh(button)
+    rebuild_layout_snapshot(db)
     return button
 
 
-def execute_button_command(position: int, db: Session):
-    """Função auxiliar para executar comando de um botão"""
+def load_button_command(position: int, db: Session) -> ButtonCommand:
+    """Busca e valida o comando de um botão, com as configurações de execução"""
     button = db.query(Button).filter(Button.position == position).first()
     if not button:
         raise HTTPException(status_code=404, detail="Botão não encontrado")
@@ -435,24 +1091,38 @@ def execute_button_command(position: int, db: Session):
     if not is_valid:
         raise HTTPException(status_code=400, detail=f"Comando inválido: {error_msg}")
 
-    try:
-        # Executa o comando no shell do macOS
-        result = subprocess.run(
-            button.command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=30,  # Timeout de 30 segundos
-            cwd=os.path.expanduser("~"),  # Executa no diretório home do usuário
-        )
+    return ButtonCommand(
+        position=button.position,
+        command=button.command,
+        timeout=button.timeout or DEFAULT_COMMAND_TIMEOUT,
+        output_limit=button.output_limit or DEFAULT_OUTPUT_LIMIT,
+        policy=button.concurrency_policy or DEFAULT_CONCURRENCY_POLICY,
+        debounce_ms=button.debounce_ms or 0,
+        max_queue=button.max_queue or DEFAULT_MAX_QUEUE,
+    )
 
-        return {
-            "success": result.returncode == 0,
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "returncode": result.returncode,
-        }
-    except subprocess.TimeoutExpired:
+
+def execution_rejected(error: ExecutionRejectedError) -> HTTPException:
+    """Resposta para acionamentos recusados pela política do botão"""
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(error))
+
+
+async def execute_button_command(
+    position: int, db: Session, api_key_id: Optional[int] = None
+):
+    """Função auxiliar para executar comando de um botão"""
+    button = load_button_command(position, db)
+    # Libera a conexão do pool enquanto o comando executa
+    db.close()
+
+    try:
+        # Executa o comando no shell do macOS sem bloquear o event loop
+        execution = button_scheduler.submit(button, api_key_id=api_key_id)
+        result = await wait_execution(execution)
+        return result.to_dict()
+    except ExecutionRejectedError as e:
+        raise execution_rejected(e)
+    except CommandTimeoutError:
         raise HTTPException(status_code=408, detail="Comando excedeu o tempo limite")
     except Exception as e:
         raise HTTPException(
@@ -460,20 +1130,140 @@ def execute_button_command(position: int, db: Session):
         )
 
 
+def submit_button_job(position: int, db: Session, api_key_id: Optional[int] = None):
+    """Agenda a execução do comando e responde 202 com o id do job"""
+    button = load_button_command(position, db)
+    db.close()
+
+    try:
+        job = job_store.submit(button, api_key_id)
+    except ExecutionRejectedError as e:
+        raise execution_rejected(e)
+    except JobStoreFullError:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Muitas execuções em andamento, tente novamente em instantes",
+            headers={"Retry-After": "1"},
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}",
+        },
+    )
+
+
 @app.post("/api/buttons/{position}/execute")
 async def execute_button(
     position: int,
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Executa o comando de um botão (requer autenticação JWT)"""
-    return execute_button_command(position, db)
+    return await execute_button_command(position, db)
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Formata um evento Server-Sent Events com payload JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que sempre fecha o gerador do corpo
+
+    Quando o cliente desconecta, o Starlette apenas abandona o gerador
+    suspenso; fechá-lo aqui executa na hora os blocos finally, em vez de
+    deixá-lo pendurado. `on_close` é chamada em seguida, mesmo que o gerador
+    nem tenha começado (cliente que desconectou antes do primeiro byte).
+    """
+
+    def __init__(self, *args, on_close: Optional[Callable[[], None]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+            if self.on_close is not None:
+                self.on_close()
+
+
+@app.post("/api/buttons/{position}/execute/stream")
+async def execute_button_stream(
+    position: int,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Executa o comando de um botão enviando a saída em tempo real (SSE)
+
+    Cada linha vira um evento `stdout` ou `stderr` com `{"line": ...}`, assim
+    que é produzida. O último evento é `exit` com `returncode` e `success`,
+    ou `timeout`/`error` se a execução falhar.
+
+    O acionamento passa pela política de concorrência e pelo debounce do
+    botão, como nos demais endpoints (409 se for recusado). Se o cliente
+    desconectar, o comando é encerrado, a menos que a execução também atenda
+    outros acionamentos (`coalesce`).
+    """
+    button = load_button_command(position, db)
+    # Libera a conexão do pool enquanto o comando executa
+    db.close()
+
+    listener: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    try:
+        execution = button_scheduler.submit(button, listener=listener)
+    except ExecutionRejectedError as e:
+        raise execution_rejected(e)
+
+    async def event_stream():
+        events = stream_execution(execution, listener)
+        try:
+            try:
+                async for kind, value in events:
+                    if kind == "exit":
+                        yield sse_event(
+                            "exit",
+                            {
+                                "returncode": value.returncode,
+                                "success": value.returncode == 0,
+                            },
+                        )
+                    else:
+                        yield sse_event(kind, {"line": value})
+            finally:
+                await events.aclose()
+        except CommandTimeoutError:
+            yield sse_event("timeout", {"detail": "Comando excedeu o tempo limite"})
+        except ExecutionRejectedError as e:
+            yield sse_event("error", {"detail": str(e)})
+        except Exception as e:
+            yield sse_event(
+                "error", {"detail": f"Erro ao executar comando: {str(e)}"}
+            )
+
+    return ClosingStreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        on_close=lambda: button_scheduler.detach(position, execution, listener),
+    )
 
 
 @app.get("/api/execute/{position}")
 async def execute_button_public(
     position: int,
     api_key: str = Query(..., description="API Key para autenticação"),
+    mode: str = Query(
+        "sync", description="`async` para responder 202 imediatamente com um job"
+    ),
     db: Session = Depends(get_db),
 ):
     """
@@ -489,30 +1279,140 @@ async def execute_button_public(
     ```
     GET http://localhost:62641/api/execute/0?api_key=SUA_API_KEY
     ```
+
+    Com `?mode=async` a resposta é `202` com um `job_id`, sem esperar o fim do
+    comando. O resultado fica disponível em `/api/jobs/{job_id}`.
     """
     # Valida API key
-    if not validate_api_key(api_key, db):
+    api_key_id = verify_api_key(api_key)
+    if api_key_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API Key inválida ou inativa",
+        )
+
+    if mode == "async":
+        return submit_button_job(position, db, api_key_id)
+    return await execute_button_command(position, db, api_key_id)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    api_key: str = Query(..., description="API Key para autenticação"),
+):
+    """
+    Consulta o status e o resultado de uma execução assíncrona (público)
+
+    `status` pode ser `pending`, `running`, `finished`, `timeout` ou `failed`.
+    Jobs concluídos ficam disponíveis por tempo limitado.
+    """
+    if not validate_api_key(api_key):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API Key inválida ou inativa",
+        )
+
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado ou expirado")
+    return job.to_dict()
+
+
+@app.get("/api/outputs/{output_id}/{stream}")
+async def get_command_output(
+    output_id: str,
+    stream: str,
+    api_key: str = Query(..., description="API Key para autenticação"),
+):
+    """
+    Baixa a saída completa (stdout ou stderr) de uma execução (público)
+
+    Disponível apenas para execuções cuja saída passou do limite do botão,
+    listadas em `output_files` no resultado. Só os arquivos mais recentes
+    são mantidos.
+    """
+    if not validate_api_key(api_key):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API Key inválida ou inativa",
         )
 
-    return execute_button_command(position, db)
+    path = spill_path(output_id, stream)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Saída não encontrada ou expirada")
+    return FileResponse(path, media_type="text/plain; charset=utf-8")
+
+
+@app.get("/api/executions/stats")
+async def get_execution_stats(
+    window: int = Query(
+        DEFAULT_STATS_WINDOW_SECONDS, description="Janela de tempo em segundos"
+    ),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    """
+    Estatísticas das execuções por botão na janela informada
+
+    Para cada botão: quantidade de execuções, falhas (código de saída
+    diferente de zero, erro ou cancelamento), timeouts e latência p50, p95,
+    p99 e máxima em ms. Execuções ainda na fila de gravação (`pending_writes`)
+    entram nas estatísticas em alguns segundos.
+    """
+    if not 1 <= window <= MAX_STATS_WINDOW_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Janela deve estar entre 1 e {MAX_STATS_WINDOW_SECONDS} segundos",
+        )
+
+    since = time.time() - window
+    buttons = await anyio.to_thread.run_sync(execution_stats, since)
+    return {
+        "window_seconds": window,
+        "since": datetime.fromtimestamp(since).isoformat(),
+        "buttons": buttons,
+        "pending_writes": execution_log_writer.pending,
+        "dropped": execution_log_writer.dropped,
+    }
+
+
+@app.get("/metrics")
+async def get_metrics(
+    api_key: str = Query(..., description="API Key para autenticação"),
+):
+    """
+    Métricas no formato texto do Prometheus (público, via API Key)
+
+    Latência por rota, consultas SQL, tempo de início e duração dos comandos,
+    conversões de imagem, profundidade das filas e execuções em andamento.
+    """
+    if not validate_api_key(api_key):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API Key inválida ou inativa",
+        )
+    return Response(content=registry.render(), media_type=METRICS_MEDIA_TYPE)
 
 
 # API Key Management
 @app.post("/api/api-keys", response_model=ApiKeyResponse)
 async def create_api_key(
     key_data: ApiKeyCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    """Cria uma nova API Key"""
+    """
+    Cria uma nova API Key
+
+    A chave completa é retornada apenas nesta resposta; o banco guarda
+    somente o digest SHA-256 e um prefixo para exibição.
+    """
     # Gera uma API key segura
     api_key = secrets.token_urlsafe(32)
 
     new_key = ApiKey(
-        key=api_key,
+        key=mask_api_key(api_key),
+        key_hash=hash_api_key(api_key),
         name=key_data.name or "API Key",
         created_at=datetime.now().isoformat(),
         is_active=1,
@@ -520,13 +1420,16 @@ async def create_api_key(
     db.add(new_key)
     db.commit()
     db.refresh(new_key)
+    load_api_key_cache()
 
-    return new_key
+    response = ApiKeyResponse.model_validate(new_key)
+    response.key = api_key
+    return response
 
 
 @app.get("/api/api-keys", response_model=List[ApiKeyResponse])
 async def list_api_keys(
-    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_user), db: Session = Depends(get_db)
 ):
     """Lista todas as API Keys"""
     keys = db.query(ApiKey).order_by(ApiKey.created_at.desc()).all()
@@ -536,7 +1439,7 @@ async def list_api_keys(
 @app.delete("/api/api-keys/{key_id}")
 async def delete_api_key(
     key_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Desativa uma API Key"""
@@ -546,6 +1449,8 @@ async def delete_api_key(
 
     key_obj.is_active = 0
     db.commit()
+    # Revogação imediata: remove a chave do índice em memória
+    load_api_key_cache()
 
     return {"message": "API Key desativada com sucesso"}
 
@@ -564,7 +1469,7 @@ async def get_setup_config():
 
 
 @app.get("/api/config")
-async def get_config(current_user: User = Depends(get_current_user)):
+async def get_config(current_user: AuthenticatedUser = Depends(get_current_user)):
     """Obtém configurações do sistema (requer autenticação)"""
     return {"button_count": int(get_config_value("button_count", "6"))}
 
@@ -631,7 +1536,8 @@ async def complete_setup_endpoint(
         # Gera primeira API Key
         api_key = secrets.token_urlsafe(32)
         new_key = ApiKey(
-            key=api_key,
+            key=mask_api_key(api_key),
+            key_hash=hash_api_key(api_key),
             name="API Key inicial",
             created_at=datetime.now().isoformat(),
             is_active=1,
@@ -642,6 +1548,8 @@ async def complete_setup_endpoint(
 
         # Marca setup como completo
         complete_setup()
+        rebuild_layout_snapshot(db)
+        load_api_key_cache()
 
         return {
             "success": True,
@@ -672,10 +1580,8 @@ async def check_setup_middleware(request, call_next):
     # Se setup não foi completado, bloqueia acesso à interface principal
     if not request.url.path.startswith("/api/"):
         if not is_setup_completed():
-            if request.url.path == "/":
-                return HTMLResponse(content=get_setup_html(), status_code=200)
-            # Redireciona outras rotas para setup
-            return HTMLResponse(content=get_setup_html(), status_code=200)
+            # Redireciona todas as rotas para setup
+            return setup_page_response(request)
 
     # Para rotas de API, verifica se setup foi completado (exceto /api/setup)
     if request.url.path.startswith("/api/") and not request.url.path.startswith(
@@ -693,45 +1599,33 @@ async def check_setup_middleware(request, call_next):
     return response
 
 
-def get_setup_html():
-    """Retorna HTML da página de setup"""
-    with open("templates/setup.html", "r", encoding="utf-8") as f:
-        return f.read()
-
-
-# Frontend
-@app.get("/", response_class=HTMLResponse)
-async def read_root():
-    """Página principal"""
-    if not is_setup_completed():
-        return HTMLResponse(content=get_setup_html(), status_code=200)
-    with open("templates/index.html", "r", encoding="utf-8") as f:
-        return f.read()
-
-
-@app.get("/setup", response_class=HTMLResponse)
-async def setup_page():
-    """Página de setup"""
-    return HTMLResponse(content=get_setup_html(), status_code=200)
+# Registrado por último para ser o mais externo: a duração medida por rota
+# inclui o tempo dos demais middlewares
+app.add_middleware(MetricsMiddleware)
 
 
-if __name__ == "__main__":
-    import uvicorn
+def setup_page_response(request: Request):
+    """Retorna HTML da página de setup (do cache em memória)"""
+    return SETUP_PAGE.response(
+        request.headers.get("accept-encoding"), request.headers.get("if-none-match")
+    )
 
 
+# Frontend
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
+async def read_root(request: Request):
     """Página principal"""
     if not is_setup_completed():
-        return HTMLResponse(content=get_setup_html(), status_code=200)
-    with open("templates/index.html", "r", encoding="utf-8") as f:
-        return f.read()
+        return setup_page_response(request)
+    return INDEX_PAGE.response(
+        request.headers.get("accept-encoding"), request.headers.get("if-none-match")
+    )
 
 
 @app.get("/setup", response_class=HTMLResponse)
-async def setup_page():
+async def setup_page(request: Request):
     """Página de setup"""
-    return HTMLResponse(content=get_setup_html(), status_code=200)
+    return setup_page_response(request)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+"""
+Captura limitada da saída dos comandos
+
+Cada stream (stdout e stderr) guarda em memória no máximo `limit` bytes: a
+primeira metade do limite com o início da saída (head) e a outra metade com
+o final mais recente (tail), descartando o meio. Assim a memória por execução
+é constante, mesmo para comandos que imprimem centenas de MB.
+
+Quando a saída passa do limite, ela passa a ser gravada também em um arquivo
+temporário (até OUTPUT_SPILL_MAX_BYTES por stream), que pode ser baixado em
+/api/outputs/<output_id>/<stream>. Apenas os OUTPUT_SPILL_FILES arquivos mais
+recentes são mantidos; os mais antigos são apagados ao criar um novo.
+
+A saída pode conter segredos, então o diretório é privado (0700, do usuário
+do servidor). Se o caminho padrão já existir com outro dono ou for um link
+simbólico, é usado um diretório novo criado com mkdtemp.
+"""
+import asyncio
+import os
+import re
+import secrets
+import stat
+import tempfile
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+# Bytes de cada stream mantidos em memória (head + tail), por botão
+DEFAULT_OUTPUT_LIMIT = 64 * 1024
+MIN_OUTPUT_LIMIT = 1024
+MAX_OUTPUT_LIMIT = 1024 * 1024
+
+# Arquivos com a saída completa de execuções que passaram do limite (caminho
+# preferido; o diretório em uso vem de output_dir())
+OUTPUT_DIR = Path(tempfile.gettempdir()) / "cyd-stream-deck-output"
+OUTPUT_SPILL_MAX_BYTES = int(
+    os.getenv("OUTPUT_SPILL_MAX_BYTES", str(16 * 1024 * 1024))
+)
+OUTPUT_SPILL_FILES = int(os.getenv("OUTPUT_SPILL_FILES", "32"))
+
+OUTPUT_STREAMS = ("stdout", "stderr")
+
+# Tamanho das leituras dos pipes
+READ_CHUNK_SIZE = 64 * 1024
+
+_OUTPUT_ID = re.compile(r"^[A-Za-z0-9_-]{16}$")
+
+_output_dir: Optional[Path] = None
+
+
+def _is_private_dir(path: Path) -> bool:
+    """Diretório real (não symlink) do usuário atual, sem acesso de outros"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and not st.st_mode & 0o077
+    )
+
+
+def _create_output_dir() -> Path:
+    try:
+        OUTPUT_DIR.mkdir(mode=0o700, exist_ok=True)
+        st = os.lstat(OUTPUT_DIR)
+        if stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid():
+            # Criado por uma versão anterior com as permissões do umask
+            os.chmod(OUTPUT_DIR, 0o700)
+    except OSError:
+        pass
+    if _is_private_dir(OUTPUT_DIR):
+        return OUTPUT_DIR
+    return Path(tempfile.mkdtemp(prefix="cyd-stream-deck-output-"))
+
+
+def output_dir() -> Path:
+    """Diretório privado das saídas gravadas, criado (ou recriado) se preciso"""
+    global _output_dir
+    if _output_dir is None or not _is_private_dir(_output_dir):
+        _output_dir = _create_output_dir()
+    return _output_dir
+
+
+def new_output_id() -> str:
+    return secrets.token_urlsafe(12)
+
+
+def spill_path(output_id: str, stream: str) -> Optional[Path]:
+    """Caminho do arquivo de uma saída, ou None se o id/stream for inválido"""
+    if not _OUTPUT_ID.match(output_id) or stream not in OUTPUT_STREAMS:
+        return None
+    return output_dir() / f"{output_id}.{stream}"
+
+
+def _rotate_spill_files():
+    """Mantém apenas os OUTPUT_SPILL_FILES - 1 arquivos mais recentes"""
+    try:
+        entries = [
+            (entry.stat().st_mtime, entry.path)
+            for entry in os.scandir(output_dir())
+            if entry.is_file(follow_symlinks=False)
+        ]
+    except OSError:
+        return
+    entries.sort()
+    for _, path in entries[: max(len(entries) - OUTPUT_SPILL_FILES + 1, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class OutputCapture:
+    """Guarda início e fim de um stream, gravando o excedente em disco"""
+
+    def __init__(self, limit: int, path: Path):
+        self.head_limit = limit // 2
+        self.tail_limit = limit - self.head_limit
+        self.path = path
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.spilled = 0
+        self._spill = None
+
+    @property
+    def dropped(self) -> int:
+        """Bytes que não estão em head/tail (omitidos da resposta)"""
+        return self.total - len(self.head) - len(self.tail)
+
+    @property
+    def has_spill(self) -> bool:
+        return self.spilled > 0
+
+    def write(self, chunk: bytes):
+        if (
+            self._spill is None
+            and len(self.head) + len(self.tail) + len(chunk)
+            > self.head_limit + self.tail_limit
+        ):
+            self._open_spill()
+        if self._spill is not None:
+            self._write_spill(chunk)
+
+        self.total += len(chunk)
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk:
+            self.tail += chunk
+            excess = len(self.tail) - self.tail_limit
+            if excess > 0:
+                del self.tail[:excess]
+
+    def _open_spill(self):
+        _rotate_spill_files()
+        try:
+            # O_EXCL/O_NOFOLLOW: nunca escreve através de um arquivo ou link
+            # criado por outro processo
+            fd = os.open(
+                self.path,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW,
+                0o600,
+            )
+            self._spill = os.fdopen(fd, "wb")
+        except OSError:
+            # Sem disco: o excedente é apenas descartado
+            self._spill = False
+            return
+        # Nada foi descartado ainda: head + tail são a saída completa até aqui
+        self._write_spill(bytes(self.head))
+        self._write_spill(bytes(self.tail))
+
+    def _write_spill(self, data: bytes):
+        if not self._spill:
+            return
+        data = data[: OUTPUT_SPILL_MAX_BYTES - self.spilled]
+        if data:
+            self._spill.write(data)
+            self.spilled += len(data)
+
+    def close(self):
+        if self._spill:
+            self._spill.close()
+
+    def text(self) -> str:
+        return (bytes(self.head) + bytes(self.tail)).decode("utf-8", errors="replace")
+
+
+async def capture_pipe(
+    stream: asyncio.StreamReader,
+    capture: OutputCapture,
+    on_chunk: Optional[Callable[[bytes], Awaitable[None]]] = None,
+):
+    """
+    Lê um pipe até o fim, sem acumular mais que o limite da captura
+
+    `on_chunk`, se informado, recebe cada pedaço lido (ex.: para enviar a
+    saída em tempo real); a leitura só continua depois que ele retorna.
+    """
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        capture.write(chunk)
+        if on_chunk is not None:
+            await on_chunk(chunk)
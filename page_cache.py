@@ -0,0 +1,128 @@
+"""
+Cache das páginas HTML (templates)
+
+Os templates são lidos uma única vez e mantidos em memória junto com as
+variantes gzip e brotli já comprimidas. Cada variante tem sua própria ETag,
+então o navegador revalida com If-None-Match e recebe 304 sem corpo.
+
+Com TEMPLATES_RELOAD=1 (modo de desenvolvimento) o arquivo é relido sempre que
+o mtime muda.
+"""
+import gzip
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi.responses import Response
+
+from http_cache import (
+    REVALIDATE_CACHE_CONTROL,
+    etag_matches,
+    make_etag,
+    not_modified_response,
+)
+
+try:
+    import brotli
+except ImportError:  # Instalação sem o requirements.txt: apenas gzip
+    brotli = None
+
+TEMPLATES_RELOAD = os.getenv("TEMPLATES_RELOAD", "").lower() in ("1", "true", "yes")
+
+# Ordem de preferência das codificações
+ENCODINGS = ("br", "gzip")
+
+
+@dataclass(frozen=True)
+class _PageVersion:
+    mtime_ns: int
+    etag: str
+    variants: Dict[str, bytes]  # "identity", "gzip" e, se disponível, "br"
+
+
+def _parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Interpreta Accept-Encoding, retornando {codificação: q}"""
+    accepted = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+class CachedPage:
+    """Página HTML mantida em memória, com variantes pré-comprimidas"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = self._load()
+
+    def _load(self) -> _PageVersion:
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        with open(self.path, "rb") as f:
+            raw = f.read()
+
+        variants = {
+            "identity": raw,
+            "gzip": gzip.compress(raw, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            variants["br"] = brotli.compress(raw, mode=brotli.MODE_TEXT)
+        return _PageVersion(mtime_ns=mtime_ns, etag=make_etag(raw), variants=variants)
+
+    def _current(self) -> _PageVersion:
+        if TEMPLATES_RELOAD:
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return self._version
+            if mtime_ns != self._version.mtime_ns:
+                with self._lock:
+                    if mtime_ns != self._version.mtime_ns:
+                        self._version = self._load()
+        return self._version
+
+    def response(
+        self,
+        accept_encoding: Optional[str] = None,
+        if_none_match: Optional[str] = None,
+    ) -> Response:
+        """Monta a resposta escolhendo a melhor variante aceita pelo cliente"""
+        version = self._current()
+
+        accepted = _parse_accept_encoding(accept_encoding)
+        encoding = "identity"
+        for candidate in ENCODINGS:
+            if candidate in version.variants and accepted.get(candidate, 0) > 0:
+                encoding = candidate
+                break
+
+        # Cada representação tem sua própria ETag forte
+        if encoding == "identity":
+            etag = version.etag
+        else:
+            etag = version.etag[:-1] + "-" + encoding + '"'
+
+        headers = {"Vary": "Accept-Encoding"}
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag, headers)
+
+        headers.update({"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            content=version.variants[encoding],
+            media_type="text/html; charset=utf-8",
+            headers=headers,
+        )
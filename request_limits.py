@@ -0,0 +1,92 @@
+"""
+Limite de tamanho do corpo das requisições
+
+O parser de multipart do Starlette grava o upload inteiro (em memória ou em
+arquivo temporário) antes de o endpoint rodar, então o limite precisa ser
+aplicado antes, no nível ASGI: requisições com Content-Length acima do limite
+são recusadas sem ler o corpo, e corpos sem Content-Length (chunked) são
+interrompidos assim que ultrapassam o limite.
+
+O limite vale para o corpo inteiro. Rotas que recebem vários arquivos (como a
+conversão em lote) têm um limite próprio, e o tamanho de cada arquivo é
+verificado pelo endpoint.
+"""
+import os
+from typing import Dict, Optional
+
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Tamanho máximo de um upload (ícone), em bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# Arquivos por requisição na conversão em lote e tamanho máximo do corpo
+# dessa requisição (por padrão, o de quatro arquivos no tamanho máximo; ícones
+# costumam ser bem menores que MAX_UPLOAD_BYTES)
+MAX_BATCH_FILES = 64
+MAX_BATCH_UPLOAD_BYTES = int(
+    os.getenv("MAX_BATCH_UPLOAD_BYTES", str(MAX_UPLOAD_BYTES * 4))
+)
+
+
+def _too_large_detail(max_bytes: int) -> str:
+    return f"Requisição excede o tamanho máximo de {max_bytes // 1024} KB"
+
+
+class BodySizeLimitMiddleware:
+    """
+    Recusa com 413 corpos de requisição maiores que `max_bytes`
+
+    `path_limits` define limites próprios para caminhos específicos.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_bytes: int = MAX_UPLOAD_BYTES,
+        path_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        content_length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    pass
+                break
+
+        if content_length is not None and content_length > max_bytes:
+            response = JSONResponse(
+                {"detail": _too_large_detail(max_bytes)},
+                status_code=413,
+                headers={"Connection": "close"},
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Propaga pelo parser do corpo até o handler de exceções
+                    raise HTTPException(
+                        status_code=413, detail=_too_large_detail(max_bytes)
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
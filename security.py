@@ -1,19 +1,48 @@
 from jose import JWTError, jwt
 import bcrypt
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from database import get_db, User
+from typing import Dict, Optional, Tuple
+from database import get_db, ApiKey, SessionLocal, User
+from metrics import FAST_BUCKETS, histogram
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Quantidade máxima de tokens verificados mantidos em cache
+TOKEN_CACHE_SIZE = 256
+
+API_KEY_VALIDATION_SECONDS = histogram(
+    "cyd_api_key_validation_duration_seconds",
+    "Duração da verificação de API keys",
+    ("result",),
+    FAST_BUCKETS,
+)
+
 security = HTTPBearer()
 
 
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """Dados do usuário autenticado mantidos no cache de tokens"""
+    id: int
+    username: str
+
+
+# Cache LRU de tokens já verificados: token -> (usuário, exp em epoch)
+_token_cache: "OrderedDict[str, Tuple[AuthenticatedUser, float]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica se a senha está correta"""
     if isinstance(hashed_password, str):
@@ -44,18 +73,34 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
+def invalidate_token_cache():
+    """Descarta todos os tokens verificados (ex.: após troca de credenciais)"""
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-):
+) -> AuthenticatedUser:
     """Valida token e retorna usuário atual"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    token = credentials.credentials
+
+    # Tokens já verificados dispensam a decodificação e a consulta ao banco
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+        if cached:
+            if cached[1] > time.time():
+                _token_cache.move_to_end(token)
+                return cached[0]
+            del _token_cache[token]
+
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
@@ -66,5 +111,68 @@ def get_current_user(
     user = db.query(User).filter(User.username == username).first()
     if user is None:
         raise credentials_exception
-    return user
 
+    authenticated = AuthenticatedUser(id=user.id, username=user.username)
+    expires_at = payload.get("exp")
+    if expires_at is not None:
+        with _token_cache_lock:
+            _token_cache[token] = (authenticated, float(expires_at))
+            while len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return authenticated
+
+
+# Índice em memória das API keys ativas: SHA-256 (hex) -> id da chave.
+# Recarregado a cada criação/desativação, então a revogação é imediata.
+_active_api_keys: Dict[str, int] = {}
+
+
+def hash_api_key(api_key: str) -> str:
+    """Gera o digest SHA-256 usado para armazenar e verificar API keys"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def mask_api_key(api_key: str) -> str:
+    """Prefixo exibível de uma API key (a chave completa não é armazenada)"""
+    return api_key[:8] + "…"
+
+
+def load_api_key_cache():
+    """
+    Recarrega o índice de API keys ativas a partir do banco
+
+    Chaves de versões anteriores, armazenadas em texto puro, são convertidas
+    para digest na primeira carga.
+    """
+    global _active_api_keys
+    db = SessionLocal()
+    try:
+        legacy_keys = db.query(ApiKey).filter(ApiKey.key_hash.is_(None)).all()
+        for key_obj in legacy_keys:
+            key_obj.key_hash = hash_api_key(key_obj.key)
+            key_obj.key = mask_api_key(key_obj.key)
+        if legacy_keys:
+            db.commit()
+
+        active_keys = db.query(ApiKey).filter(ApiKey.is_active == 1).all()
+        _active_api_keys = {key_obj.key_hash: key_obj.id for key_obj in active_keys}
+    finally:
+        db.close()
+
+
+def verify_api_key(api_key: str) -> Optional[int]:
+    """
+    Verifica uma API key sem acessar o banco
+
+    A chave recebida é convertida em digest antes da busca, então o tempo da
+    consulta não revela nada sobre as chaves armazenadas.
+
+    Returns:
+        O id da chave, se ela existir e estiver ativa; None caso contrário
+    """
+    start = time.perf_counter()
+    key_id = _active_api_keys.get(hash_api_key(api_key)) if api_key else None
+    API_KEY_VALIDATION_SECONDS.observe(
+        time.perf_counter() - start, "valid" if key_id is not None else "invalid"
+    )
+    return key_id
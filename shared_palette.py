@@ -0,0 +1,115 @@
+"""
+Paleta de 256 cores compartilhada por todos os ícones do layout
+
+Com `img.convert("P", palette=Image.ADAPTIVE)` cada ícone ganha a sua própria
+paleta, e o painel precisa guardar e trocar 1 KB de paleta por ícone. No modo
+indexado, o servidor quantiza todos os ícones atuais juntos em uma única
+paleta, servida separadamente:
+
+    GET /api/buttons/palette?api_key=...&fmt=rgb888|rgb565
+
+e os ícones (`/uploads/<icone>?fmt=indexed` e o atlas com `fmt=indexed`)
+trazem apenas os índices, um byte por pixel. A paleta é gerada novamente
+quando algum ícone muda; o cabeçalho `X-Palette-Id` das respostas indexadas
+identifica a paleta a que os índices se referem.
+"""
+import asyncio
+import hashlib
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+import anyio
+
+from http_cache import make_etag
+from image_utils import build_shared_palette, image_conversion_service
+from layout_cache import current_cell_size, layout_icon_paths
+
+PALETTE_FORMATS = ("rgb888", "rgb565")
+
+RENDITIONS_DIR = Path("uploads") / "renditions"
+
+
+@dataclass(frozen=True)
+class SharedPalette:
+    key: tuple
+    id: str
+    rgb888: bytes  # 256 x (R, G, B)
+    rgb565: bytes  # 256 x u16 little-endian
+
+    def data(self, fmt: str) -> bytes:
+        return self.rgb565 if fmt == "rgb565" else self.rgb888
+
+    def etag(self, fmt: str) -> str:
+        return make_etag(self.data(fmt))
+
+
+def _to_rgb565(palette: bytes) -> bytes:
+    return b"".join(
+        struct.pack(
+            "<H",
+            ((palette[i] & 0xF8) << 8)
+            | ((palette[i + 1] & 0xFC) << 3)
+            | (palette[i + 2] >> 3),
+        )
+        for i in range(0, len(palette), 3)
+    )
+
+
+def _remove_stale_renditions(palette_id: str):
+    """Remove renditions indexadas geradas com paletas anteriores"""
+    if not RENDITIONS_DIR.exists():
+        return
+    for path in RENDITIONS_DIR.glob("*.idx*"):
+        if f"_{palette_id}." not in path.name:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+class SharedPaletteCache:
+    """Mantém a paleta compartilhada dos ícones atuais"""
+
+    def __init__(self):
+        self._palette: Optional[SharedPalette] = None
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+
+    async def get(self) -> SharedPalette:
+        """
+        Retorna a paleta dos ícones atuais, gerando-a se algum ícone mudou
+
+        Raises:
+            ConversionBusyError, ConversionTimeoutError: do pool de conversão
+        """
+        key = (layout_icon_paths(), current_cell_size())
+        palette = self._palette
+        if palette is not None and palette.key == key:
+            return palette
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            in_flight = asyncio.ensure_future(self._build(key))
+            self._in_flight[key] = in_flight
+            in_flight.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(in_flight)
+
+    async def _build(self, key: tuple) -> SharedPalette:
+        icons, (width, height) = key
+        rgb888 = await image_conversion_service.run(
+            build_shared_palette, [path for _, path in icons], width, height
+        )
+        palette = SharedPalette(
+            key=key,
+            id=hashlib.sha256(rgb888).hexdigest()[:16],
+            rgb888=rgb888,
+            rgb565=_to_rgb565(rgb888),
+        )
+        if self._palette is None or self._palette.id != palette.id:
+            await anyio.to_thread.run_sync(_remove_stale_renditions, palette.id)
+        self._palette = palette
+        return palette
+
+
+shared_palette_cache = SharedPaletteCache()